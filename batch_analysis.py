@@ -0,0 +1,306 @@
+"""Analyze a directory of documents in bulk through the OpenAI Batch API
+
+Each document gets the same analysis and legal terms glossary as the
+interactive app, at batch pricing and without tying up the UI. Documents too
+long for one request are map-reduced as in the app: a first batch summarizes
+their chunks and a follow-up batch merges the summaries. Finished analyses are
+written to the Analysis History store, where new app sessions pick them up.
+
+Progress is kept in a work directory, so a job can be polled from another
+process or resumed after an interruption. To try it offline, start
+benchmarks/mock_openai_server.py and set LEXIGUIDE_OPENAI_BASE_URL.
+
+Usage:
+    python batch_analysis.py run CONTRACT_DIR --work-dir WORK_DIR
+    python batch_analysis.py prepare CONTRACT_DIR --work-dir WORK_DIR
+    python batch_analysis.py submit --work-dir WORK_DIR
+    python batch_analysis.py poll --work-dir WORK_DIR [--wait]
+"""
+import argparse
+import json
+import os
+import time
+from datetime import datetime
+
+from dotenv import load_dotenv
+from openai import OpenAI
+from PIL import Image
+
+from document_analysis import CHUNK_TOKENS, analysis_messages, chunk_messages, legal_terms_messages, reduce_messages
+from document_store import load_text, spill_text, store_analyses
+from image_ocr import iter_frames, ocr_pages
+from pdf_extraction import OCR_ENABLED, extract_pdf_pages, join_pages, ocr_empty_pages
+from text_chunking import estimate_tokens, split_into_chunks
+from token_budget import fit_messages
+
+BATCH_MODEL = os.getenv('LEXIGUIDE_BATCH_MODEL', 'gpt-4o')
+# The Batch API accepts at most 50,000 requests per input file
+MAX_BATCH_REQUESTS = int(os.getenv('LEXIGUIDE_BATCH_MAX_REQUESTS', '50000'))
+POLL_INTERVAL_S = float(os.getenv('LEXIGUIDE_BATCH_POLL_S', '30'))
+# Requests that fail this many times are given up on; their document is skipped
+MAX_ATTEMPTS = 3
+
+TEXT_EXTENSIONS = ('.txt', '.md')
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.tif', '.tiff')
+FINISHED_STATUSES = ('completed', 'failed', 'expired', 'cancelled')
+
+
+def extract_file_text(path):
+    """Extract the text of a PDF, page image or plain text file, or None for other files"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension in TEXT_EXTENSIONS:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            return f.read()
+    if extension == '.pdf':
+        pages = extract_pdf_pages(path)
+        if OCR_ENABLED:
+            pages = ocr_empty_pages(path, pages)
+        return join_pages(pages)
+    if extension in IMAGE_EXTENSIONS:
+        with Image.open(path) as image:
+            return join_pages(ocr_pages(list(iter_frames(image))))
+    return None
+
+
+def _manifest_path(work_dir):
+    return os.path.join(work_dir, "manifest.json")
+
+
+def load_manifest(work_dir):
+    with open(_manifest_path(work_dir), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(work_dir, manifest):
+    path = _manifest_path(work_dir)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+def prepare(source_dir, work_dir, model=None):
+    """Extract every document in source_dir and start a new job manifest in work_dir
+
+    Extracted texts are stored once per content in the document store; the
+    manifest only records names and digests.
+    """
+    documents = {}
+    for name in sorted(os.listdir(source_dir)):
+        path = os.path.join(source_dir, name)
+        if not os.path.isfile(path):
+            continue
+        try:
+            text = extract_file_text(path)
+        except Exception as e:
+            # One unreadable file must not abort a job over thousands
+            print(f"skipped {name}: {e}")
+            continue
+        if not text or not text.strip():
+            print(f"skipped {name}: no text")
+            continue
+        documents[f"doc{len(documents)}"] = {'name': os.path.splitext(name)[0], 'digest': spill_text(text)}
+
+    os.makedirs(work_dir, exist_ok=True)
+    manifest = {
+        'model': model or BATCH_MODEL,
+        'documents': documents,
+        'round': 0,
+        'batches': [],
+        'results': {},
+        'failures': {},
+        'stored': False,
+    }
+    save_manifest(work_dir, manifest)
+    print(f"prepared {len(documents)} documents in {work_dir}")
+    return manifest
+
+
+def pending_requests(manifest):
+    """Return (custom_id, messages) for every request the job still needs
+
+    Each document needs its legal terms and its analysis. Short documents are
+    analyzed in one request; long ones first need a summary of every chunk, and
+    then one request merging them, which can only be built once the summaries
+    are in. Requests that failed MAX_ATTEMPTS times are not retried.
+    """
+    results, failures = manifest['results'], manifest['failures']
+    requests = []
+
+    def need(custom_id, build):
+        if custom_id not in results and failures.get(custom_id, 0) < MAX_ATTEMPTS:
+            requests.append((custom_id, build()))
+
+    for doc_id, document in manifest['documents'].items():
+        text = load_text(document['digest'])
+        need(f"{doc_id}/terms", lambda: legal_terms_messages(text))
+        if estimate_tokens(text) <= CHUNK_TOKENS:
+            need(f"{doc_id}/analysis", lambda: analysis_messages(text))
+            continue
+
+        chunks = split_into_chunks(text, CHUNK_TOKENS)
+        part_ids = [f"{doc_id}/part/{i}" for i in range(len(chunks))]
+        for i, (part_id, chunk) in enumerate(zip(part_ids, chunks)):
+            need(part_id, lambda: chunk_messages(chunk, i + 1, len(chunks)))
+        if all(part_id in results for part_id in part_ids):
+            # Summaries still too long for one request are trimmed rather than condensed again
+            need(f"{doc_id}/analysis", lambda: reduce_messages([results[part_id] for part_id in part_ids]))
+    return requests
+
+
+def write_batch_files(work_dir, manifest, requests):
+    """Write the requests as Batch API input files and return their paths"""
+    model = manifest['model']
+    paths = []
+    for start in range(0, len(requests), MAX_BATCH_REQUESTS):
+        path = os.path.join(work_dir, f"round{manifest['round']}-{len(paths)}.jsonl")
+        with open(path, "w", encoding="utf-8") as f:
+            for custom_id, messages in requests[start:start + MAX_BATCH_REQUESTS]:
+                f.write(json.dumps({
+                    "custom_id": custom_id,
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": {"model": model, "messages": fit_messages(messages, model)},
+                }) + "\n")
+        paths.append(path)
+    return paths
+
+
+def submit(client, work_dir, manifest):
+    """Submit the job's next round of requests; returns False when none are left"""
+    if manifest['batches']:
+        print(f"round {manifest['round']} is still running; poll it first")
+        return True
+    requests = pending_requests(manifest)
+    if not requests:
+        return False
+
+    manifest['round'] += 1
+    manifest['batches'] = []
+    for path in write_batch_files(work_dir, manifest, requests):
+        with open(path, "rb") as f:
+            input_file = client.files.create(file=f, purpose="batch")
+        batch = client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+            metadata={"job": "lexiguide-batch-analysis", "round": str(manifest['round'])}
+        )
+        manifest['batches'].append(batch.id)
+    save_manifest(work_dir, manifest)
+    print(f"round {manifest['round']}: submitted {len(requests)} requests in {len(manifest['batches'])} batches")
+    return True
+
+
+def _file_lines(client, file_id):
+    if not file_id:
+        return []
+    return [json.loads(line) for line in client.files.content(file_id).text.splitlines() if line.strip()]
+
+
+def _read_results(client, batch, manifest):
+    """Record the replies and failures of a finished batch
+
+    Every request of the batch's input without a successful reply counts as
+    one failed attempt, including those a failed, expired or cancelled batch
+    never ran; otherwise they would be resubmitted forever.
+    """
+    for result in _file_lines(client, batch.output_file_id) + _file_lines(client, batch.error_file_id):
+        response = result.get('response') or {}
+        if response.get('status_code') == 200:
+            manifest['results'][result['custom_id']] = response['body']['choices'][0]['message']['content']
+
+    for request in _file_lines(client, batch.input_file_id):
+        custom_id = request['custom_id']
+        if custom_id not in manifest['results']:
+            manifest['failures'][custom_id] = manifest['failures'].get(custom_id, 0) + 1
+
+
+def collect(client, work_dir, manifest):
+    """Collect finished batches of the current round; returns True when all are finished"""
+    remaining = []
+    for batch_id in manifest['batches']:
+        batch = client.batches.retrieve(batch_id)
+        if batch.status not in FINISHED_STATUSES:
+            remaining.append(batch_id)
+            continue
+        # Expired and cancelled batches still return whatever they completed
+        _read_results(client, batch, manifest)
+        print(f"batch {batch_id}: {batch.status}")
+    manifest['batches'] = remaining
+    save_manifest(work_dir, manifest)
+    return not remaining
+
+
+def store_results(manifest):
+    """Write every analyzed document to the Analysis History store"""
+    results = manifest['results']
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    entries = [
+        {
+            'document_name': document['name'],
+            'analysis': results[f"{doc_id}/analysis"],
+            'legal_terms': results.get(f"{doc_id}/terms", ""),
+            # The extracted text stays in the document store, so the document can be loaded from the history
+            'text_id': document['digest'],
+            'date_analyzed': now,
+            'last_analyzed': now,
+            'feedback': []
+        }
+        for doc_id, document in manifest['documents'].items()
+        if f"{doc_id}/analysis" in results
+    ]
+    store_analyses(entries)
+    manifest['stored'] = True
+    print(f"stored {len(entries)} of {len(manifest['documents'])} analyses in the Analysis History")
+
+
+def poll(client, work_dir, wait=False, interval=None):
+    """Advance the job: collect finished batches, submit the next round, store results when done"""
+    interval = interval or POLL_INTERVAL_S
+    manifest = load_manifest(work_dir)
+    while True:
+        if manifest['batches'] and not collect(client, work_dir, manifest):
+            if not wait:
+                print("batches still running")
+                return manifest
+            time.sleep(interval)
+            continue
+        if submit(client, work_dir, manifest):
+            if not wait:
+                return manifest
+            continue
+        if not manifest['stored']:
+            store_results(manifest)
+            save_manifest(work_dir, manifest)
+        return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("command", choices=("run", "prepare", "submit", "poll"))
+    parser.add_argument("source_dir", nargs="?", help="directory of documents (run and prepare)")
+    parser.add_argument("--work-dir", required=True, help="where the job's manifest and request files are kept")
+    parser.add_argument("--model", help=f"model to analyze with (default: {BATCH_MODEL})")
+    parser.add_argument("--wait", action="store_true", help="poll until the whole job is done")
+    parser.add_argument("--interval", type=float, help="seconds between polls")
+    args = parser.parse_args()
+
+    if args.command in ("run", "prepare"):
+        if not args.source_dir:
+            parser.error(f"{args.command} needs the directory of documents")
+        prepare(args.source_dir, args.work_dir, args.model)
+        if args.command == "prepare":
+            return
+
+    load_dotenv()
+    base_url = os.getenv('LEXIGUIDE_OPENAI_BASE_URL')
+    client = OpenAI(api_key=os.getenv('OPENAI_API_KEY') or ("mock" if base_url else None), base_url=base_url)
+    if args.command == "submit":
+        submit(client, args.work_dir, load_manifest(args.work_dir))
+    else:
+        poll(client, args.work_dir, wait=args.wait or args.command == "run", interval=args.interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""Measure LLM-path throughput and tail latency against the offline mock API
+
+Runs concurrent document questions or full document analyses through the
+LLM gateway (limits, retries, deadlines) and reports requests per second and
+latency percentiles. By default a mock server is started in-process; pass
+--base-url to target one started separately (or any compatible endpoint).
+
+Usage:
+    python benchmarks/llm_throughput.py [--workload question|analysis] [--requests 200] [--concurrency 16]
+        [--stream] [--latency lognormal:300,0.5] [--error-rate 0.02] [--base-url URL]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from openai import OpenAI  # noqa: E402
+
+from document_analysis import analyze_document  # noqa: E402
+from llm_gateway import LLMGateway, deadline_after  # noqa: E402
+from mock_openai_server import MockConfig, start_server  # noqa: E402
+from retrieval_index import build_pages, percentile  # noqa: E402
+
+
+def question_messages(document, i):
+    return [
+        {"role": "system", "content": "You are a legal assistant. Answer questions about the provided document."},
+        {"role": "user", "content": f"Document: {document}\nQuestion {i}: what are the termination conditions?"},
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workload", choices=("question", "analysis"), default="question")
+    parser.add_argument("--requests", type=int, default=200, help="questions or analyses to run")
+    parser.add_argument("--concurrency", type=int, default=16, help="simultaneous callers")
+    parser.add_argument("--stream", action="store_true", help="stream question replies and report time to first token")
+    parser.add_argument("--pages", type=int, default=2, help="pages per generated document (analysis uses 10x)")
+    parser.add_argument("--model", default="gpt-4o")
+    parser.add_argument("--deadline", type=float, default=60.0, help="seconds allowed per question or analysis")
+    parser.add_argument("--max-concurrency", type=int, default=8, help="gateway requests in flight per model")
+    parser.add_argument("--rpm", type=float, default=6000, help="gateway request rate limit per model")
+    parser.add_argument("--base-url", help="use this API instead of starting the mock in-process")
+    parser.add_argument("--latency", default="lognormal:300,0.5")
+    parser.add_argument("--token-latency", default="fixed:5")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    mock = None
+    base_url = args.base_url
+    if not base_url:
+        mock = MockConfig(
+            latency=args.latency,
+            token_latency=args.token_latency,
+            error_rate=args.error_rate,
+            retry_after=0.2,
+            seed=args.seed,
+        )
+        _, base_url = start_server(mock)
+    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY", "mock"), base_url=base_url, max_retries=0)
+    gateway = LLMGateway(client, max_concurrency=args.max_concurrency, requests_per_minute=args.rpm)
+
+    pages = build_pages(args.pages * (10 if args.workload == "analysis" else 1), args.seed)
+    document = "\n\n".join(pages)
+    first_token = []
+
+    def ask(i):
+        deadline = deadline_after(args.deadline)
+        messages = question_messages(document, i)
+        if not args.stream:
+            return gateway.chat(args.model, messages, deadline).choices[0].message.content
+        start = time.perf_counter()
+        parts = []
+        for chunk in gateway.stream_chat(args.model, messages, deadline):
+            if chunk.choices and chunk.choices[0].delta.content:
+                if not parts:
+                    first_token.append(1000 * (time.perf_counter() - start))
+                parts.append(chunk.choices[0].delta.content)
+        return "".join(parts)
+
+    def analyze(i):
+        deadline = deadline_after(args.deadline)
+        # Vary the text so each analysis is a distinct set of requests
+        text = f"Contract {i}\n\n{document}"
+        return analyze_document(text, lambda messages: gateway.chat(args.model, messages, deadline).choices[0].message.content, chunk_tokens=2000)
+
+    task = ask if args.workload == "question" else analyze
+    latencies = []
+    failures = 0
+
+    def timed(i):
+        start = time.perf_counter()
+        try:
+            task(i)
+        except Exception:
+            return None
+        return 1000 * (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        for latency in executor.map(timed, range(args.requests)):
+            if latency is None:
+                failures += 1
+            else:
+                latencies.append(latency)
+    elapsed = time.perf_counter() - start
+
+    print(f"{args.workload}: {args.requests} runs, {args.concurrency} callers, {elapsed:.2f} s, "
+          f"{args.requests / elapsed:.1f} runs/s, {failures} failed")
+    if latencies:
+        print(f"{'latency ms':<14} {'mean':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}")
+        print(f"{'end to end':<14} {statistics.mean(latencies):>8.0f} {percentile(latencies, 0.5):>8.0f} "
+              f"{percentile(latencies, 0.95):>8.0f} {percentile(latencies, 0.99):>8.0f} {max(latencies):>8.0f}")
+    if first_token:
+        print(f"{'first token':<14} {statistics.mean(first_token):>8.0f} {percentile(first_token, 0.5):>8.0f} "
+              f"{percentile(first_token, 0.95):>8.0f} {percentile(first_token, 0.99):>8.0f} {max(first_token):>8.0f}")
+    for model, stats in gateway.stats().items():
+        print(f"gateway {model}: {stats}")
+    if mock is not None:
+        print(f"mock server: {mock.requests} requests, {mock.errors} injected errors")
+
+
+if __name__ == "__main__":
+    main()
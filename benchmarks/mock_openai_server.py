@@ -0,0 +1,430 @@
+"""Offline stand-in for the OpenAI chat completions, embeddings and Batch endpoints
+
+Replies are generated deterministically from the request, and latency and
+failures are drawn from configurable distributions with a fixed seed, so
+load and tail-latency runs are repeatable and cost nothing. Point the app at
+it with LEXIGUIDE_OPENAI_BASE_URL=http://127.0.0.1:8765/v1.
+
+Batch jobs (/v1/files and /v1/batches) are run in the background after a
+delay drawn from --batch-latency; each request in them can fail with the same
+injected error rate as interactive calls.
+
+Latency distributions are given as name:params in milliseconds:
+    fixed:200  uniform:100,400  normal:300,50  lognormal:300,0.5 (median, sigma)  exponential:300 (mean)
+
+Usage:
+    python benchmarks/mock_openai_server.py [--port 8765] [--latency lognormal:300,0.5]
+        [--token-latency fixed:5] [--error-rate 0.02] [--error-statuses 429,500,503] [--seed 7]
+        [--batch-latency fixed:2000]
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import random
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPLY_VOCABULARY = (
+    "the agreement provides that each party shall perform its obligations under this lease including "
+    "payment of rent notice of termination indemnification confidentiality and compliance with the "
+    "governing law key points summary legal terms tenant landlord premises term renewal default remedy"
+).split()
+
+ERROR_TYPES = {
+    429: "rate_limit_exceeded",
+    500: "server_error",
+    502: "server_error",
+    503: "server_error",
+}
+
+
+def parse_distribution(spec):
+    """Turn 'name:a,b' into a function of a Random returning seconds"""
+    name, _, params = spec.partition(":")
+    values = [float(value) for value in params.split(",") if value]
+    seconds = [value / 1000 for value in values]
+    if name == "fixed":
+        return lambda rng: seconds[0]
+    if name == "uniform":
+        return lambda rng: rng.uniform(seconds[0], seconds[1])
+    if name == "normal":
+        return lambda rng: max(0.0, rng.gauss(seconds[0], seconds[1]))
+    if name == "lognormal":
+        # The second parameter is the unitless shape, not a duration
+        return lambda rng: seconds[0] * rng.lognormvariate(0.0, values[1])
+    if name == "exponential":
+        return lambda rng: rng.expovariate(1 / seconds[0]) if seconds[0] else 0.0
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+class MockConfig:
+    """Latency, reply size and failure settings shared by all request handlers"""
+
+    def __init__(self, latency="fixed:0", token_latency="fixed:0", reply_words=120, error_rate=0.0,
+                 error_statuses=(429, 500, 503), retry_after=1.0, embedding_dim=1536, seed=7,
+                 batch_latency="fixed:0"):
+        self.latency = parse_distribution(latency)
+        self.token_latency = parse_distribution(token_latency)
+        self.batch_latency = parse_distribution(batch_latency)
+        self.reply_words = reply_words
+        self.error_rate = error_rate
+        self.error_statuses = tuple(error_statuses)
+        self.retry_after = retry_after
+        self.embedding_dim = embedding_dim
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+
+    def draw(self, distribution):
+        with self._lock:
+            return distribution(self._rng)
+
+    def injected_error(self):
+        """Status code to fail this request with, or None"""
+        with self._lock:
+            self.requests += 1
+            if self.error_rate and self._rng.random() < self.error_rate:
+                self.errors += 1
+                return self._rng.choice(self.error_statuses)
+        return None
+
+
+def _seed_for(payload):
+    return int.from_bytes(hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).digest()[:8], "big")
+
+
+def reply_text(model, messages, words):
+    """Deterministic reply for a conversation: the same request always gets the same text"""
+    rng = random.Random(_seed_for([model, messages]))
+    return " ".join(rng.choice(REPLY_VOCABULARY) for _ in range(words)).capitalize() + "."
+
+
+def embedding(text, dim):
+    """Deterministic pseudo-embedding of text"""
+    rng = random.Random(_seed_for(text))
+    return [rng.gauss(0.0, 1.0) for _ in range(dim)]
+
+
+def _estimate_tokens(text):
+    return max(1, len(text) // 4)
+
+
+def _error_body(status):
+    return {"error": {
+        "message": f"Injected mock error ({status})",
+        "type": ERROR_TYPES.get(status, "server_error"),
+        "code": ERROR_TYPES.get(status, "server_error"),
+    }}
+
+
+def completion_body(model, messages, reply_words):
+    """Non-streamed chat completion response for a request"""
+    content = reply_text(model, messages, reply_words)
+    prompt_tokens = sum(_estimate_tokens(str(message.get("content", ""))) for message in messages)
+    return {
+        "id": f"chatcmpl-mock-{_seed_for([model, messages]) % 10 ** 12}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": _estimate_tokens(content),
+            "total_tokens": prompt_tokens + _estimate_tokens(content),
+        },
+    }
+
+
+class BatchStore:
+    """Uploaded files and batch jobs of the mock server"""
+
+    def __init__(self, config):
+        self.config = config
+        self.files = {}
+        self.batches = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def add_file(self, data, filename, purpose):
+        with self._lock:
+            file_id = f"file-mock-{next(self._ids)}"
+            self.files[file_id] = (data, {
+                "id": file_id,
+                "object": "file",
+                "bytes": len(data),
+                "created_at": int(time.time()),
+                "filename": filename,
+                "purpose": purpose,
+                "status": "processed",
+            })
+        return self.files[file_id][1]
+
+    def create_batch(self, payload):
+        with self._lock:
+            batch_id = f"batch-mock-{next(self._ids)}"
+            batch = self.batches[batch_id] = {
+                "id": batch_id,
+                "object": "batch",
+                "endpoint": payload.get("endpoint", "/v1/chat/completions"),
+                "input_file_id": payload["input_file_id"],
+                "completion_window": payload.get("completion_window", "24h"),
+                "status": "in_progress",
+                "created_at": int(time.time()),
+                "output_file_id": None,
+                "error_file_id": None,
+                "request_counts": {"total": 0, "completed": 0, "failed": 0},
+                "metadata": payload.get("metadata"),
+            }
+        threading.Thread(target=self._run_batch, args=(batch_id,), daemon=True).start()
+        return dict(batch)
+
+    def _run_batch(self, batch_id):
+        time.sleep(self.config.draw(self.config.batch_latency))
+        batch = self.batches[batch_id]
+        data, _ = self.files[batch["input_file_id"]]
+        output, errors = [], []
+        for line in data.decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            status = self.config.injected_error()
+            body = _error_body(status) if status else completion_body(
+                request["body"].get("model", "mock"), request["body"].get("messages", []), self.config.reply_words
+            )
+            result = {
+                "id": f"batch-req-mock-{next(self._ids)}",
+                "custom_id": request["custom_id"],
+                "response": {"status_code": status or 200, "request_id": f"req-mock-{next(self._ids)}", "body": body},
+                "error": None,
+            }
+            (errors if status else output).append(json.dumps(result))
+
+        with self._lock:
+            for name, lines in (("output_file_id", output), ("error_file_id", errors)):
+                if lines:
+                    file_id = f"file-mock-{next(self._ids)}"
+                    content = ("\n".join(lines) + "\n").encode("utf-8")
+                    self.files[file_id] = (content, {"id": file_id, "object": "file", "bytes": len(content),
+                                                     "created_at": int(time.time()), "filename": f"{batch_id}.jsonl",
+                                                     "purpose": "batch_output", "status": "processed"})
+                    batch[name] = file_id
+            batch["request_counts"] = {"total": len(output) + len(errors), "completed": len(output), "failed": len(errors)}
+            batch["completed_at"] = int(time.time())
+            batch["status"] = "completed"
+
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def config(self):
+        return self.server.config
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_error(self, status):
+        headers = {"Retry-After": str(self.config.retry_after)} if status == 429 else None
+        self._send_json(status, _error_body(status), headers)
+
+    def _send_not_found(self):
+        self._send_json(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+
+    def _send_event(self, body):
+        data = b"data: " + (body if isinstance(body, bytes) else json.dumps(body).encode("utf-8")) + b"\n\n"
+        # One HTTP chunk per server-sent event
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length)
+
+    def do_GET(self):
+        store = self.server.store
+        parts = self.path.rstrip("/").split("/")
+        if len(parts) == 4 and parts[2] == "batches" and parts[3] in store.batches:
+            self._send_json(200, store.batches[parts[3]])
+        elif len(parts) == 5 and parts[2] == "files" and parts[4] == "content" and parts[3] in store.files:
+            data = store.files[parts[3]][0]
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        else:
+            self._send_not_found()
+
+    def do_POST(self):
+        body = self._read_body()
+        path = self.path.rstrip("/")
+        if path == "/v1/files":
+            self._upload_file(body)
+            return
+        payload = json.loads(body or b"{}")
+        if path == "/v1/batches":
+            self._send_json(200, self.server.store.create_batch(payload))
+            return
+
+        handlers = {
+            "/v1/chat/completions": self._chat_completions,
+            "/v1/embeddings": self._embeddings,
+        }
+        handler = handlers.get(path)
+        if handler is None:
+            self._send_not_found()
+            return
+
+        time.sleep(self.config.draw(self.config.latency))
+        status = self.config.injected_error()
+        if status:
+            self._send_error(status)
+            return
+        handler(payload)
+
+    def _upload_file(self, body):
+        # Multipart form: a 'purpose' field and the 'file' itself
+        message = BytesParser(policy=HTTP).parsebytes(
+            f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode("latin-1") + body
+        )
+        fields, data, filename = {}, b"", "upload.jsonl"
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            if name == "file":
+                data = part.get_payload(decode=True)
+                filename = part.get_filename() or filename
+            else:
+                fields[name] = part.get_content().strip()
+        self._send_json(200, self.server.store.add_file(data, filename, fields.get("purpose", "batch")))
+
+    def _chat_completions(self, payload):
+        model = payload.get("model", "mock")
+        messages = payload.get("messages", [])
+        body = completion_body(model, messages, self.config.reply_words)
+        if not payload.get("stream"):
+            self._send_json(200, body)
+            return
+
+        content = body["choices"][0]["message"]["content"]
+        usage = body["usage"]
+        completion_id = body["id"]
+        created = body["created"]
+        include_usage = (payload.get("stream_options") or {}).get("include_usage")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def chunk(delta, finish_reason=None):
+            return {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+                "usage": None,
+            }
+
+        self._send_event(chunk({"role": "assistant", "content": ""}))
+        words = content.split(" ")
+        for i, word in enumerate(words):
+            if i:
+                time.sleep(self.config.draw(self.config.token_latency))
+            self._send_event(chunk({"content": word if i == 0 else f" {word}"}))
+        self._send_event(chunk({}, "stop"))
+        if include_usage:
+            self._send_event({
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [],
+                "usage": usage,
+            })
+        self._send_event(b"[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _embeddings(self, payload):
+        texts = payload.get("input", [])
+        if isinstance(texts, str):
+            texts = [texts]
+        self._send_json(200, {
+            "object": "list",
+            "model": payload.get("model", "mock"),
+            "data": [
+                {"object": "embedding", "index": i, "embedding": embedding(text, self.config.embedding_dim)}
+                for i, text in enumerate(texts)
+            ],
+            "usage": {"prompt_tokens": sum(map(_estimate_tokens, texts)), "total_tokens": sum(map(_estimate_tokens, texts))},
+        })
+
+
+def make_server(config, host="127.0.0.1", port=0):
+    """Create the mock API server; port 0 picks a free port"""
+    server = ThreadingHTTPServer((host, port), MockOpenAIHandler)
+    server.daemon_threads = True
+    server.config = config
+    server.store = BatchStore(config)
+    return server
+
+
+def start_server(config, host="127.0.0.1", port=0):
+    """Serve in a background thread; returns (server, base_url)"""
+    server = make_server(config, host, port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", default="lognormal:300,0.5", help="time before the reply (or first token) starts")
+    parser.add_argument("--token-latency", default="fixed:5", help="gap between streamed tokens")
+    parser.add_argument("--reply-words", type=int, default=120)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests failed on purpose")
+    parser.add_argument("--error-statuses", default="429,500,503", help="statuses injected errors are drawn from")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with injected 429s")
+    parser.add_argument("--embedding-dim", type=int, default=1536)
+    parser.add_argument("--batch-latency", default="fixed:2000", help="time before a submitted batch job completes")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    config = MockConfig(
+        latency=args.latency,
+        token_latency=args.token_latency,
+        reply_words=args.reply_words,
+        error_rate=args.error_rate,
+        error_statuses=[int(status) for status in args.error_statuses.split(",")],
+        retry_after=args.retry_after,
+        embedding_dim=args.embedding_dim,
+        seed=args.seed,
+        batch_latency=args.batch_latency,
+    )
+    server = make_server(config, args.host, args.port)
+    print(f"Mock OpenAI API on http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"{config.requests} requests, {config.errors} injected errors")
+
+
+if __name__ == "__main__":
+    main()
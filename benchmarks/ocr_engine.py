@@ -0,0 +1,66 @@
+"""Compare per-page OCR latency of spawn-per-call pytesseract and persistent engines
+
+pytesseract starts the tesseract binary and loads the language model on every
+call; the persistent path (tesserocr) keeps engines loaded between calls.
+Pages come from the generated sample set in ocr_preprocessing.py.
+
+Usage:
+    python benchmarks/ocr_engine.py [--repeat 3] [--preset fast]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import pytesseract
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import image_ocr  # noqa: E402
+from ocr_preprocessing import build_sample_set  # noqa: E402
+
+
+def _spawn_per_call(image):
+    return pytesseract.image_to_string(image, lang=image_ocr.OCR_LANG) or ""
+
+
+def measure(ocr, pages, repeat):
+    latencies = []
+    for _ in range(repeat):
+        for page in pages:
+            start = time.perf_counter()
+            ocr(page)
+            latencies.append(1000 * (time.perf_counter() - start))
+    return latencies
+
+
+def report(name, latencies):
+    ordered = sorted(latencies)
+    p95 = ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+    print(f"{name:<12} {statistics.mean(latencies):>9.1f} {statistics.median(latencies):>9.1f} {p95:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3, help="passes over the sample set")
+    parser.add_argument("--preset", default="fast", help="preprocessing preset applied before timing")
+    args = parser.parse_args()
+
+    # Preprocess up front so only the OCR call itself is timed
+    pages = [image_ocr.preprocess_image(image, args.preset) for _, image in build_sample_set()]
+    print(f"{len(pages)} pages x {args.repeat} passes")
+    print(f"{'engine':<12} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9}")
+
+    report("spawn", measure(_spawn_per_call, pages, args.repeat))
+    if image_ocr.tesserocr is None:
+        print("persistent   skipped: tesserocr is not installed")
+        return
+    # Warm one engine so its model load is not attributed to the first page
+    image_ocr.image_to_text(pages[0])
+    report("persistent", measure(image_ocr.image_to_text, pages, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Compare OCR wall time and character accuracy across preprocessing presets
+
+The sample set is generated deterministically: short legal passages rendered
+as text, then upscaled, rotated and noised to mimic phone photos of documents.
+
+Usage:
+    python benchmarks/ocr_preprocessing.py [--presets none,fast,standard] [--repeat 1]
+"""
+import argparse
+import difflib
+import os
+import random
+import sys
+import time
+
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from image_ocr import OCR_PRESETS, ocr_image  # noqa: E402
+
+SAMPLE_PASSAGES = [
+    "This Agreement shall commence on the Effective Date and continue for a period of twelve months.",
+    "The Tenant shall indemnify and hold harmless the Landlord from any claims arising out of the premises.",
+    "Either party may terminate this Agreement upon thirty days written notice to the other party.",
+    "The Receiving Party shall not disclose Confidential Information to any third party without consent.",
+    "This Agreement shall be governed by and construed in accordance with the laws of the State of New Jersey.",
+    "Any dispute arising hereunder shall be resolved by binding arbitration in accordance with its rules.",
+]
+
+# (upscale factor, rotation degrees, noise amplitude) per distortion profile
+PHOTO_PROFILES = [
+    (1, 0.0, 0),
+    (3, 1.5, 20),
+    (4, -2.5, 35),
+]
+
+
+def _load_font(size):
+    for name in ("DejaVuSans.ttf", "Arial.ttf", "LiberationSans-Regular.ttf"):
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            continue
+    return ImageFont.load_default()
+
+
+def render_sample(text, upscale, angle, noise, seed):
+    """Render text as a page image distorted like a phone photo"""
+    font = _load_font(28)
+    words = text.split()
+    lines, line = [], ""
+    for word in words:
+        candidate = f"{line} {word}".strip()
+        if len(candidate) > 40:
+            lines.append(line)
+            line = word
+        else:
+            line = candidate
+    lines.append(line)
+
+    page = Image.new("RGB", (900, 80 + 44 * len(lines)), (245, 242, 235))
+    draw = ImageDraw.Draw(page)
+    for i, line in enumerate(lines):
+        draw.text((40, 40 + 44 * i), line, fill=(20, 20, 30), font=font)
+
+    if upscale > 1:
+        page = page.resize((page.width * upscale, page.height * upscale), Image.BICUBIC)
+    if angle:
+        page = page.rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor=(245, 242, 235))
+    if noise:
+        rng = random.Random(seed)
+        pixels = page.load()
+        for _ in range(page.width * page.height // 50):
+            x, y = rng.randrange(page.width), rng.randrange(page.height)
+            shift = rng.randint(-noise, noise)
+            r, g, b = pixels[x, y]
+            pixels[x, y] = (max(0, min(255, r + shift)), max(0, min(255, g + shift)), max(0, min(255, b + shift)))
+        page = page.filter(ImageFilter.GaussianBlur(radius=0.6))
+    return page
+
+
+def build_sample_set():
+    samples = []
+    for i, text in enumerate(SAMPLE_PASSAGES):
+        for j, (upscale, angle, noise) in enumerate(PHOTO_PROFILES):
+            samples.append((text, render_sample(text, upscale, angle, noise, seed=i * 10 + j)))
+    return samples
+
+
+def character_accuracy(expected, actual):
+    """Similarity of whitespace-normalized strings, in [0, 1]"""
+    expected = " ".join(expected.split())
+    actual = " ".join(actual.split())
+    return difflib.SequenceMatcher(None, expected, actual).ratio()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--presets", default=",".join(OCR_PRESETS), help="comma-separated preset names")
+    parser.add_argument("--repeat", type=int, default=1, help="OCR passes per sample")
+    args = parser.parse_args()
+
+    samples = build_sample_set()
+    print(f"{len(samples)} samples")
+    print(f"{'preset':<10} {'total s':>9} {'ms/image':>9} {'accuracy':>9}")
+    for preset in args.presets.split(","):
+        elapsed = 0.0
+        scores = []
+        for expected, image in samples:
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                text = ocr_image(image, preset)
+                elapsed += time.perf_counter() - start
+            scores.append(character_accuracy(expected, text))
+        runs = len(samples) * args.repeat
+        print(f"{preset:<10} {elapsed:>9.2f} {1000 * elapsed / runs:>9.1f} {sum(scores) / len(scores):>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Compare top-k passage lookup with the BM25 inverted index against a naive scan
+
+The document is generated deterministically from a legal vocabulary so runs
+are comparable across machines.
+
+Usage:
+    python benchmarks/retrieval_index.py [--pages 300] [--queries 200]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from retrieval import DocumentIndex, scan_search  # noqa: E402
+
+VOCABULARY = (
+    "agreement party parties tenant landlord lease premises rent payment term termination notice "
+    "indemnify liability damages breach remedy arbitration jurisdiction governing law confidential "
+    "information disclosure obligation warranty representation covenant assignment successor "
+    "insurance default cure period effective date renewal option deposit maintenance repair "
+    "compliance statute regulation consent waiver amendment severability force majeure"
+).split()
+FILLER = "the of and to in a shall be by for with any such this or as on".split()
+
+
+def build_pages(page_count, seed):
+    rng = random.Random(seed)
+    pages = []
+    for _ in range(page_count):
+        paragraphs = []
+        for _ in range(6):
+            words = [rng.choice(VOCABULARY if rng.random() < 0.4 else FILLER) for _ in range(90)]
+            paragraphs.append(" ".join(words).capitalize() + ".")
+        pages.append("\n\n".join(paragraphs))
+    return pages
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=300, help="pages in the generated document")
+    parser.add_argument("--queries", type=int, default=200, help="number of timed queries")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    pages = build_pages(args.pages, args.seed)
+    start = time.perf_counter()
+    index = DocumentIndex()
+    for page in pages:
+        index.add_text(page)
+    build_ms = 1000 * (time.perf_counter() - start)
+    print(f"{len(index.chunks)} passages, {len(index.postings)} terms, built incrementally in {build_ms:.1f} ms")
+
+    rng = random.Random(args.seed + 1)
+    queries = [" ".join(rng.sample(VOCABULARY, 3)) for _ in range(args.queries)]
+
+    print(f"{'method':<10} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9}")
+    for name, search in (
+        ("index", lambda query: index.search(query)),
+        ("scan", lambda query: scan_search(index.chunks, query)),
+    ):
+        latencies = []
+        for query in queries:
+            start = time.perf_counter()
+            search(query)
+            latencies.append(1000 * (time.perf_counter() - start))
+        print(f"{name:<10} {statistics.mean(latencies):>9.2f} {percentile(latencies, 0.5):>9.2f} {percentile(latencies, 0.95):>9.2f}")
+
+    # Both paths implement the same scoring, so their top results must agree
+    mismatches = sum(
+        [i for i, _ in index.search(query)] != [i for i, _ in scan_search(index.chunks, query)]
+        for query in queries[:20]
+    )
+    print(f"top-k mismatches on 20 queries: {mismatches}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import os
+
+from token_budget import count_tokens, message_tokens
+
+# Tokens of earlier turns (plus their running summary) sent with each question
+HISTORY_TOKENS = int(os.getenv('LEXIGUIDE_CHAT_HISTORY_TOKENS', '1500'))
+# Target length of the running summary of older turns
+SUMMARY_WORDS = 150
+
+
+def new_memory():
+    """Empty conversation memory: a running summary and how many turns it covers"""
+    return {'summary': "", 'summarized': 0}
+
+
+def summary_messages(summary, turns):
+    """Messages asking the model to fold turns into the running summary"""
+    transcript = "\n".join(f"{turn['role'].capitalize()}: {turn['content']}" for turn in turns)
+    previous = f"Summary so far:\n{summary}\n\n" if summary else ""
+    return [
+        {"role": "system", "content": "You maintain a concise running summary of a conversation between a user and a legal assistant."},
+        {"role": "user", "content": f"{previous}New messages:\n{transcript}\n\nUpdate the summary to include the new messages. Keep facts, names, document details and open questions. Use at most {SUMMARY_WORDS} words."}
+    ]
+
+
+def compact_history(history, memory, summarize, model, budget=None):
+    """Return the recent turns to send verbatim, folding older ones into memory's summary
+
+    history holds the prior turns in order; memory is updated in place. Once
+    the unsummarized turns exceed the budget, the oldest are summarized until
+    the rest fit in half of it, so each turn is summarized at most once and
+    summarization runs only every few turns. summarize(summary, turns) returns
+    the new summary text. If it fails, memory keeps its old summary, the
+    recent turns are still returned, and the next question tries again.
+    """
+    budget = budget or HISTORY_TOKENS
+    start = memory['summarized']
+    turns = history[start:]
+    tokens = [message_tokens(turn, model) for turn in turns]
+    total = sum(tokens) + count_tokens(memory['summary'], model)
+    if total <= budget:
+        return turns
+
+    evict = 0
+    while evict < len(turns) and total > budget // 2:
+        total -= tokens[evict]
+        evict += 1
+    try:
+        summary = summarize(memory['summary'], turns[:evict])
+    except Exception:
+        return turns[evict:]
+    memory['summary'] = summary
+    memory['summarized'] = start + evict
+    return turns[evict:]
+
+
+def build_messages(system_prompt, history, user_content, memory, summarize, model, budget=None):
+    """Chat messages for a new question: system prompt, summary, recent turns, then the question"""
+    recent = compact_history(history, memory, summarize, model, budget)
+    messages = [{"role": "system", "content": system_prompt}]
+    if memory['summary']:
+        messages.append({"role": "system", "content": f"Summary of the earlier conversation:\n{memory['summary']}"})
+    messages.extend({"role": turn['role'], "content": turn['content']} for turn in recent)
+    messages.append({"role": "user", "content": user_content})
+    return messages
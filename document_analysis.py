@@ -0,0 +1,103 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from text_chunking import estimate_tokens, split_into_chunks
+
+# Documents above this many (estimated) tokens are analyzed chunk by chunk
+CHUNK_TOKENS = int(os.getenv('LEXIGUIDE_ANALYSIS_CHUNK_TOKENS', '6000'))
+# Maximum number of chunk summaries requested at once
+CONCURRENCY = int(os.getenv('LEXIGUIDE_ANALYSIS_CONCURRENCY', '4'))
+# Upper bound on extra condensing passes when chunk summaries are still too long
+_MAX_CONDENSE_PASSES = 3
+
+ANALYSIS_SYSTEM_PROMPT = "You are a legal document analyzer. Provide a clear summary, highlight key points, and explain important legal terms used."
+
+CHUNK_SYSTEM_PROMPT = "You are a legal document analyzer. You are given one section of a longer legal document."
+
+LEGAL_TERMS_SYSTEM_PROMPT = "You are a legal terminology expert. Extract and explain legal terms from the document."
+
+
+def analysis_messages(text):
+    """Messages for analyzing a whole document in a single request"""
+    return [
+        {"role": "system", "content": ANALYSIS_SYSTEM_PROMPT},
+        {"role": "user", "content": f"Analyze this legal document and provide: 1) A summary 2) Key points 3) Legal terms used with their explanations:\n\n{text}"}
+    ]
+
+
+def legal_terms_messages(text):
+    """Messages for the legal terms glossary of a document"""
+    return [
+        {"role": "system", "content": LEGAL_TERMS_SYSTEM_PROMPT},
+        {"role": "user", "content": f"Extract all legal terms from this document and provide their definitions in simple language:\n\n{text}"}
+    ]
+
+
+def chunk_messages(chunk, index, total):
+    """Messages for the map step: condense one chunk"""
+    return [
+        {"role": "system", "content": CHUNK_SYSTEM_PROMPT},
+        {"role": "user", "content": f"This is part {index} of {total} of a legal document. Summarize it concisely, listing its key points (obligations, rights, dates, amounts, parties) and any legal terms used with short explanations:\n\n{chunk}"}
+    ]
+
+
+def reduce_messages(summaries):
+    """Messages for the reduce step: merge chunk summaries into the final analysis"""
+    joined = "\n\n".join(f"Part {i + 1}:\n{summary}" for i, summary in enumerate(summaries))
+    return [
+        {"role": "system", "content": ANALYSIS_SYSTEM_PROMPT},
+        {"role": "user", "content": f"The following are summaries of consecutive parts of one legal document. Combine them and provide for the whole document: 1) A summary 2) Key points 3) Legal terms used with their explanations:\n\n{joined}"}
+    ]
+
+
+def map_chunks(chunks, complete, concurrency):
+    """Summarize chunks concurrently, returning summaries in chunk order"""
+    total = len(chunks)
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, total))) as executor:
+        return list(executor.map(
+            lambda item: complete(chunk_messages(item[1], item[0] + 1, total)),
+            enumerate(chunks)
+        ))
+
+
+def final_messages(text, complete, chunk_tokens=None, concurrency=None):
+    """Return the messages of the request that produces the final analysis
+
+    Short documents need a single request, so its messages are returned as is.
+    Longer ones are split into chunks that are summarized concurrently (map);
+    the returned messages then merge those summaries into the usual Summary /
+    Key points / Legal terms format (reduce). If the summaries are themselves
+    too long for one request they are condensed again first.
+    complete is called with a list of chat messages and returns the reply text.
+    """
+    chunk_tokens = chunk_tokens or CHUNK_TOKENS
+    concurrency = concurrency or CONCURRENCY
+
+    if estimate_tokens(text) <= chunk_tokens:
+        return analysis_messages(text)
+
+    summaries = map_chunks(split_into_chunks(text, chunk_tokens), complete, concurrency)
+    for _ in range(_MAX_CONDENSE_PASSES):
+        if len(summaries) == 1 or estimate_tokens("\n\n".join(summaries)) <= chunk_tokens:
+            break
+        # Condense groups of summaries until they fit a single reduce request
+        summaries = map_chunks(split_into_chunks("\n\n".join(summaries), chunk_tokens), complete, concurrency)
+    return reduce_messages(summaries)
+
+
+def analyze_document(text, complete, chunk_tokens=None, concurrency=None, summarize=None):
+    """Analyze a legal document, map-reducing over chunks when it is too long
+
+    summarize, if given, is used instead of complete for the chunk summaries,
+    e.g. to send them to a cheaper model than the final request.
+    """
+    return complete(final_messages(text, summarize or complete, chunk_tokens, concurrency))
+
+
+def stream_analysis(text, complete, stream, chunk_tokens=None, concurrency=None):
+    """Like analyze_document, but yield the final request's reply as it is generated
+
+    complete is used for the chunk summaries only; stream is called with the
+    final request's messages and yields pieces of the reply.
+    """
+    yield from stream(final_messages(text, complete, chunk_tokens, concurrency))
@@ -0,0 +1,86 @@
+import hashlib
+import json
+import os
+import threading
+
+# Private per-user directory for data kept between sessions (caches, stored documents)
+DATA_DIR = os.getenv('LEXIGUIDE_DATA_DIR', os.path.join(os.path.expanduser('~'), '.lexiguide'))
+# Stored document texts and their embeddings
+DOCUMENT_DIR = os.getenv('LEXIGUIDE_DOCUMENT_DIR', os.path.join(DATA_DIR, 'documents'))
+# Saved documents with more characters than this are kept on disk instead of in session state
+MAX_RESIDENT_TEXT_CHARS = int(os.getenv('LEXIGUIDE_MAX_RESIDENT_TEXT_CHARS', '200000'))
+# Analyses written by the batch pipeline; new sessions start their Analysis History from it
+ANALYSIS_HISTORY_PATH = os.getenv('LEXIGUIDE_ANALYSIS_HISTORY_PATH', os.path.join(DOCUMENT_DIR, 'analysis-history.json'))
+
+
+def private_dir(path):
+    """Create directory path, and any missing parents, readable only by the current user; returns path
+
+    Directories that already exist keep their permissions.
+    """
+    if not os.path.isdir(path):
+        private_dir(os.path.dirname(os.path.abspath(path)))
+        os.makedirs(path, mode=0o700, exist_ok=True)
+    return path
+
+
+def text_digest(text):
+    """Content hash identifying a document's text"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def document_path(digest, suffix=".txt"):
+    """Path of a file stored for the document with the given digest"""
+    return os.path.join(DOCUMENT_DIR, f"{digest}{suffix}")
+
+
+def should_spill(text):
+    """Whether text is too large to keep resident under the configured policy"""
+    return len(text) > MAX_RESIDENT_TEXT_CHARS
+
+
+def spill_text(text):
+    """Write text to the document directory (once per content) and return its digest"""
+    digest = text_digest(text)
+    path = document_path(digest)
+    if not os.path.exists(path):
+        private_dir(DOCUMENT_DIR)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    return digest
+
+
+def load_text(digest):
+    """Read back text previously written by spill_text"""
+    with open(document_path(digest), "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def load_analysis_history(path=None):
+    """Return the stored Analysis History entries, or an empty list"""
+    path = path or ANALYSIS_HISTORY_PATH
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+
+def store_analyses(entries, path=None):
+    """Add entries to the stored Analysis History, replacing any with the same document name"""
+    path = path or ANALYSIS_HISTORY_PATH
+    history = {entry['document_name']: entry for entry in load_analysis_history(path)}
+    for entry in entries:
+        previous = history.get(entry['document_name'])
+        if previous:
+            # Keep the original date and any feedback given on the earlier analysis
+            entry = {**entry, 'date_analyzed': previous['date_analyzed'], 'feedback': previous.get('feedback', [])}
+        history[entry['document_name']] = entry
+
+    private_dir(os.path.dirname(path) or ".")
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(list(history.values()), f, indent=1)
+    os.replace(tmp_path, path)
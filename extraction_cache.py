@@ -0,0 +1,116 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+
+def content_key(data, settings=None):
+    """Build a cache key from the uploaded bytes and the extractor settings
+
+    data may be a single bytes object or a list of them for multi-file uploads.
+    """
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        digest = hashlib.sha256(data)
+    else:
+        digest = hashlib.sha256()
+        for chunk in data:
+            # Length-prefix each file so different splits of the same bytes differ
+            digest.update(len(chunk).to_bytes(8, "big"))
+            digest.update(chunk)
+    if settings:
+        # Sort so that the same settings always produce the same key
+        digest.update(repr(sorted(settings.items())).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ExtractionCache:
+    """LRU cache of extracted document text with an optional on-disk tier
+
+    The in-memory tier is bounded by the total number of characters held.
+    When disk_dir is set, every entry is also written there as a text file so
+    it survives server restarts and memory evictions.
+    """
+
+    def __init__(self, max_chars=64 * 1024 * 1024, disk_dir=None):
+        self.max_chars = max_chars
+        self.disk_dir = disk_dir
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.txt")
+
+    def _store(self, key, text):
+        # Caller must hold the lock
+        if key in self._entries:
+            self._size -= len(self._entries.pop(key))
+        if len(text) > self.max_chars:
+            return
+        self._entries[key] = text
+        self._size += len(text)
+        while self._size > self.max_chars:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+            self.evictions += 1
+
+    def get(self, key):
+        """Return the cached text for key, or None on a miss"""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+
+        if self.disk_dir and os.path.exists(self._disk_path(key)):
+            try:
+                with open(self._disk_path(key), "r", encoding="utf-8") as f:
+                    text = f.read()
+            except OSError:
+                text = None
+            if text is not None:
+                with self._lock:
+                    self._store(key, text)
+                    self.disk_hits += 1
+                return text
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, text):
+        """Store extracted text under key"""
+        with self._lock:
+            self._store(key, text)
+
+        if self.disk_dir:
+            # Write to a temp file first so readers never see a partial entry
+            tmp_path = f"{self._disk_path(key)}.{threading.get_ident()}.tmp"
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.write(text)
+                os.replace(tmp_path, self._disk_path(key))
+            except OSError:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+    def stats(self):
+        """Return hit/miss counters and current size for monitoring"""
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'cached_chars': self._size,
+            }
@@ -0,0 +1,377 @@
+import os
+import queue
+from concurrent.futures.process import BrokenProcessPool
+from difflib import SequenceMatcher
+
+import numpy as np
+import pytesseract
+from PIL import Image, ImageOps, ImageSequence
+
+try:
+    import tesserocr  # In-process Tesseract API; keeps the language model loaded between calls
+except ImportError:
+    tesserocr = None
+
+from worker_pool import get_pool, reset_pool
+
+# Preprocessing presets for Tesseract. max_side caps the longest edge; target_dpi
+# also downscales images whose DPI metadata looks like a real scan resolution.
+OCR_PRESETS = {
+    'none': {
+        'grayscale': False,
+        'target_dpi': None,
+        'max_side': None,
+        'deskew': False,
+        'binarize': False,
+    },
+    'fast': {
+        'grayscale': True,
+        'target_dpi': 200,
+        'max_side': 2000,
+        'deskew': False,
+        'binarize': True,
+    },
+    'standard': {
+        'grayscale': True,
+        'target_dpi': 300,
+        'max_side': 3000,
+        'deskew': True,
+        'binarize': True,
+    },
+    'accurate': {
+        'grayscale': True,
+        'target_dpi': 300,
+        'max_side': 4000,
+        'deskew': True,
+        'binarize': False,
+    },
+}
+
+DEFAULT_PRESET = os.getenv('LEXIGUIDE_OCR_PRESET', 'standard')
+
+# 'auto' uses persistent tesserocr engines when installed, 'pytesseract' always spawns the binary
+OCR_ENGINE = os.getenv('LEXIGUIDE_OCR_ENGINE', 'auto')
+OCR_LANG = os.getenv('LEXIGUIDE_OCR_LANG', 'eng')
+
+# Preprocessed images larger than this many pixels are OCR'd as parallel bands
+TILE_THRESHOLD_PIXELS = int(os.getenv('LEXIGUIDE_OCR_TILE_THRESHOLD_MP', '8')) * 1000 * 1000
+TILE_WORKERS = int(os.getenv('LEXIGUIDE_OCR_WORKERS', str(os.cpu_count() or 1)))
+# Rows shared by neighbouring bands so a text line cut by one band is whole in the other
+TILE_OVERLAP_ROWS = int(os.getenv('LEXIGUIDE_OCR_TILE_OVERLAP', '80'))
+# Band boundaries are moved to the emptiest row within this distance of the nominal cut
+_BAND_SNAP_ROWS = 60
+# Overlapping lines of neighbouring bands at least this similar are emitted once
+_STITCH_MIN_SIMILARITY = 0.8
+# Rows with less mean ink than this (0-255) count as blank when counting text lines
+_BLANK_ROW_INK = 2.0
+
+# DPI metadata below this is a placeholder (e.g. 72 on phone photos), not a scan resolution
+_MIN_TRUSTED_DPI = 150
+
+# Skew angles (degrees) tried when deskewing
+_DESKEW_MAX_ANGLE = 5.0
+_DESKEW_STEP = 0.5
+# Deskew angle search runs on a copy no larger than this on its longest side
+_DESKEW_SEARCH_SIDE = 800
+
+
+# Idle tesserocr engines of this process; each is used by one thread at a time
+_engines = queue.LifoQueue()
+# Set when a tesserocr engine could not be created, e.g. a pip build looking in
+# the wrong tessdata directory; the process then uses pytesseract instead
+_engine_error = None
+
+
+def persistent_engine_available():
+    """Whether OCR runs on long-lived in-process engines instead of spawning tesseract"""
+    return tesserocr is not None and OCR_ENGINE != 'pytesseract' and _engine_error is None
+
+
+def image_to_text(image):
+    """Run Tesseract on a PIL image
+
+    With tesserocr installed, engines are kept alive and reused so the
+    language model is loaded once per process rather than once per call.
+    Otherwise, or when no engine can be created, falls back to pytesseract,
+    which spawns the tesseract binary.
+    """
+    global _engine_error
+    if not persistent_engine_available():
+        return pytesseract.image_to_string(image, lang=OCR_LANG) or ""
+
+    try:
+        engine = _engines.get_nowait()
+    except queue.Empty:
+        try:
+            engine = tesserocr.PyTessBaseAPI(lang=OCR_LANG)
+        except Exception as e:
+            _engine_error = e
+            return pytesseract.image_to_string(image, lang=OCR_LANG) or ""
+    try:
+        engine.SetImage(image)
+        return engine.GetUTF8Text() or ""
+    finally:
+        engine.Clear()
+        _engines.put(engine)
+
+
+def _rescale(image, target_dpi, max_side):
+    """Downscale to the target DPI and to max_side, whichever is smaller; never upscales
+
+    DPI values below _MIN_TRUSTED_DPI are ignored: cameras and JFIF writers
+    stamp 72 or 96 dpi on photos regardless of their real resolution.
+    """
+    scale = 1.0
+    dpi = image.info.get('dpi')
+    if target_dpi and dpi and dpi[0] >= _MIN_TRUSTED_DPI:
+        scale = min(scale, target_dpi / float(dpi[0]))
+    if max_side:
+        scale = min(scale, max_side / float(max(image.size)))
+    if scale >= 1.0:
+        return image
+    new_size = (max(1, int(image.width * scale)), max(1, int(image.height * scale)))
+    return image.resize(new_size, Image.LANCZOS)
+
+
+def otsu_threshold(gray):
+    """Return the Otsu threshold for a grayscale PIL image"""
+    histogram = np.bincount(np.asarray(gray, dtype=np.uint8).ravel(), minlength=256).astype(np.float64)
+    total = histogram.sum()
+    if total == 0:
+        return 128
+    levels = np.arange(256)
+    weight_bg = np.cumsum(histogram)
+    weight_fg = total - weight_bg
+    cum_mean = np.cumsum(histogram * levels)
+    mean_bg = cum_mean / np.maximum(weight_bg, 1)
+    mean_fg = (cum_mean[-1] - cum_mean) / np.maximum(weight_fg, 1)
+    between = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+    return int(np.argmax(between))
+
+
+def _binarize(gray):
+    threshold = otsu_threshold(gray)
+    return gray.point(lambda value: 255 if value > threshold else 0)
+
+
+def estimate_skew(gray):
+    """Estimate the text skew angle in degrees using a projection profile search
+
+    Text lines produce sharply peaked row sums when horizontal, so the angle
+    maximizing the variance of the row profile is taken as the skew.
+    """
+    small = gray.copy()
+    small.thumbnail((_DESKEW_SEARCH_SIDE, _DESKEW_SEARCH_SIDE))
+    # Invert so ink is bright and the background contributes nothing to row sums
+    ink = _binarize(small).point(lambda value: 255 - value)
+
+    best_angle, best_score = 0.0, -1.0
+    steps = int(_DESKEW_MAX_ANGLE / _DESKEW_STEP)
+    for i in range(-steps, steps + 1):
+        angle = i * _DESKEW_STEP
+        rotated = ink.rotate(angle, resample=Image.NEAREST, expand=True, fillcolor=0)
+        profile = np.asarray(rotated, dtype=np.float32).sum(axis=1)
+        score = float(profile.var())
+        if score > best_score:
+            best_angle, best_score = angle, score
+    return best_angle
+
+
+def preprocess_image(image, preset=None):
+    """Prepare a PIL image for Tesseract according to a named preset or settings dict"""
+    settings = OCR_PRESETS[preset or DEFAULT_PRESET] if not isinstance(preset, dict) else preset
+
+    # Respect camera orientation before anything else
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ('L', 'RGB'):
+        image = image.convert('RGB')
+
+    image = _rescale(image, settings['target_dpi'], settings['max_side'])
+
+    if settings['grayscale'] or settings['deskew'] or settings['binarize']:
+        image = image.convert('L')
+
+    if settings['deskew']:
+        angle = estimate_skew(image)
+        if angle:
+            image = image.rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor=255)
+
+    if settings['binarize']:
+        image = _binarize(image)
+
+    return image
+
+
+def preview_thumbnail(image, width):
+    """Return a small RGB copy of image for display at the given width
+
+    The thumbnail is twice the display width so it stays sharp on HiDPI screens.
+    """
+    thumbnail = ImageOps.exif_transpose(image)
+    if thumbnail.mode not in ('L', 'RGB'):
+        thumbnail = thumbnail.convert('RGB')
+    thumbnail = thumbnail.copy()
+    thumbnail.thumbnail((width * 2, width * 2 * 10))
+    return thumbnail
+
+
+def _emptiest_row(ink, low, high):
+    """Row in [low, high] with the least ink, preferring the first on ties"""
+    return low + int(np.argmin(ink[low:high + 1]))
+
+
+def _row_ink(gray):
+    """Ink per row of a grayscale image; the darker the row, the larger the value"""
+    return 255.0 - np.asarray(gray, dtype=np.float32).mean(axis=1)
+
+
+def count_text_lines(ink):
+    """Number of runs of inked rows, i.e. text lines, in a slice of _row_ink"""
+    inked = ink > _BLANK_ROW_INK
+    if not len(inked):
+        return 0
+    return int(inked[0]) + int(np.count_nonzero(inked[1:] & ~inked[:-1]))
+
+
+def split_bands(gray, bands, overlap):
+    """Split a grayscale image into overlapping horizontal bands
+
+    Each nominal cut is snapped to the row with the least ink nearby so that
+    cuts tend to fall between text lines, and so is each band's overlapped
+    top and bottom edge, so a band neither starts nor ends halfway through a
+    line. Returns (top, bottom) row ranges.
+    """
+    height = gray.height
+    bands = max(1, min(bands, height // max(1, 4 * overlap)))
+    if bands == 1:
+        return [(0, height)]
+
+    ink = _row_ink(gray)
+    cuts = [0]
+    for i in range(1, bands):
+        nominal = height * i // bands
+        low = max(cuts[-1] + 1, nominal - _BAND_SNAP_ROWS)
+        high = min(height - 1, nominal + _BAND_SNAP_ROWS)
+        cuts.append(_emptiest_row(ink, low, high))
+    cuts.append(height)
+
+    ranges = []
+    for i in range(bands):
+        top, bottom = 0, height
+        if i > 0:
+            # Search around cut - overlap, never past the cut itself
+            edge = cuts[i] - overlap
+            top = _emptiest_row(ink, max(0, edge - _BAND_SNAP_ROWS), min(cuts[i], edge + _BAND_SNAP_ROWS))
+        if i < bands - 1:
+            edge = cuts[i + 1] + overlap
+            bottom = _emptiest_row(ink, max(cuts[i + 1], edge - _BAND_SNAP_ROWS), min(height - 1, edge + _BAND_SNAP_ROWS)) + 1
+        ranges.append((top, bottom))
+    return ranges
+
+
+def _ocr_band(band):
+    """Worker: OCR a single preprocessed band"""
+    return image_to_text(band)
+
+
+def _normalize_line(line):
+    return " ".join(line.split()).lower()
+
+
+def _lines_match(a, b):
+    """Whether two normalized lines are the same line as read by two bands
+
+    OCR of the same line in neighbouring bands can differ by a few characters,
+    so near-identical lines count as a match.
+    """
+    return a == b or SequenceMatcher(None, a, b).ratio() >= _STITCH_MIN_SIMILARITY
+
+
+def stitch_band_texts(texts, overlap_lines=None):
+    """Join band texts in order, dropping lines repeated because of the overlap
+
+    The longest run of trailing lines of one band that matches the leading
+    lines of the next band is emitted only once. overlap_lines[i], when given,
+    is how many text lines bands i and i + 1 share; no more lines than that
+    are dropped, so a line that really repeats at a band edge (e.g. a
+    signature line) is kept.
+    """
+    lines = []
+    for i, text in enumerate(texts):
+        band_lines = [line for line in text.splitlines() if line.strip()]
+        normalized_tail = [_normalize_line(line) for line in lines[-len(band_lines):]] if band_lines else []
+        normalized_head = [_normalize_line(line) for line in band_lines]
+        longest = min(len(normalized_tail), len(normalized_head))
+        if overlap_lines is not None and i > 0:
+            longest = min(longest, overlap_lines[i - 1])
+        skip = 0
+        for size in range(longest, 0, -1):
+            if all(map(_lines_match, normalized_tail[-size:], normalized_head[:size])):
+                skip = size
+                break
+        lines.extend(band_lines[skip:])
+    return "\n".join(lines)
+
+
+def ocr_tiled(image, workers=None, overlap=None):
+    """OCR a large preprocessed image as overlapping bands across processes"""
+    workers = workers or TILE_WORKERS
+    overlap = TILE_OVERLAP_ROWS if overlap is None else overlap
+    gray = image if image.mode == 'L' else image.convert('L')
+
+    ranges = split_bands(gray, workers, overlap)
+    if len(ranges) == 1:
+        return _ocr_band(image)
+
+    bands = [image.crop((0, top, image.width, bottom)) for top, bottom in ranges]
+    pool = get_pool()
+    try:
+        texts = [future.result() for future in [pool.submit(_ocr_band, band) for band in bands]]
+    except BrokenProcessPool:
+        # Fall back to OCR-ing the whole image in-process
+        reset_pool(pool)
+        return _ocr_band(image)
+    ink = _row_ink(gray)
+    overlap_lines = [count_text_lines(ink[ranges[i + 1][0]:ranges[i][1]]) for i in range(len(ranges) - 1)]
+    return stitch_band_texts(texts, overlap_lines)
+
+
+def ocr_image(image, preset=None, tile_threshold=None):
+    """Preprocess a PIL image and run Tesseract on it
+
+    Images still larger than tile_threshold pixels after preprocessing are
+    split into bands and OCR'd in parallel.
+    """
+    threshold = TILE_THRESHOLD_PIXELS if tile_threshold is None else tile_threshold
+    prepared = preprocess_image(image, preset)
+    if TILE_WORKERS > 1 and prepared.width * prepared.height > threshold:
+        text = ocr_tiled(prepared)
+    else:
+        text = image_to_text(prepared)
+    return text if text else ""
+
+
+def iter_frames(image):
+    """Yield every frame of a possibly multi-page image (e.g. TIFF) as its own copy"""
+    for frame in ImageSequence.Iterator(image):
+        yield frame.copy()
+
+
+def _ocr_page(image, preset):
+    """Worker: OCR one page; pages are already spread across the pool, so no tiling"""
+    return ocr_image(image, preset, tile_threshold=float('inf'))
+
+
+def ocr_pages(images, preset=None, workers=None):
+    """OCR several page images concurrently, returning their texts in page order"""
+    workers = workers or TILE_WORKERS
+    if workers <= 1 or len(images) <= 1:
+        return [ocr_image(image, preset) for image in images]
+
+    pool = get_pool()
+    try:
+        futures = [pool.submit(_ocr_page, image, preset) for image in images]
+        return [future.result() for future in futures]
+    except BrokenProcessPool:
+        reset_pool(pool)
+        return [ocr_image(image, preset) for image in images]
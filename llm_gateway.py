@@ -0,0 +1,293 @@
+import random
+import threading
+import time
+
+import openai
+
+# Errors worth retrying: throttling, timeouts, dropped connections and 5xx responses
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+
+class DeadlineExceeded(TimeoutError):
+    """The call could not complete before its deadline"""
+
+
+def deadline_after(seconds):
+    """Absolute deadline (time.monotonic() based) the given number of seconds from now"""
+    return time.monotonic() + seconds
+
+
+def _remaining(deadline):
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise DeadlineExceeded("LLM call deadline exceeded")
+    return remaining
+
+
+class TokenBucket:
+    """Token-bucket rate limiter: `rate` requests per second with bursts up to `capacity`"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, deadline):
+        """Take one token, waiting for it if needed; returns the time spent waiting"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                wait = (1 - self._tokens) / self.rate
+            if wait > _remaining(deadline):
+                raise DeadlineExceeded("Rate limit wait would exceed the deadline")
+            time.sleep(wait)
+            waited += wait
+
+
+class LLMGateway:
+    """Shared, resilient access to the OpenAI API for all sessions
+
+    Each model gets a concurrency limit (semaphore) and a request rate limit
+    (token bucket). Retryable failures are retried with jittered exponential
+    backoff, honouring Retry-After. Every call carries an absolute deadline that
+    bounds queueing, backoff sleeps and the request timeout, so callers sharing
+    one deadline (e.g. the chunks of one analysis) stop together.
+    """
+
+    def __init__(self, client, max_concurrency=8, requests_per_minute=500, max_retries=5,
+                 base_delay=0.5, max_delay=20.0, default_timeout=60.0,
+                 concurrency_overrides=None, rpm_overrides=None):
+        self.client = client
+        self.max_concurrency = max_concurrency
+        self.requests_per_minute = requests_per_minute
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.default_timeout = default_timeout
+        self.concurrency_overrides = concurrency_overrides or {}
+        self.rpm_overrides = rpm_overrides or {}
+        self._semaphores = {}
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def _limits(self, model):
+        with self._lock:
+            if model not in self._semaphores:
+                concurrency = int(self.concurrency_overrides.get(model, self.max_concurrency))
+                rpm = self.rpm_overrides.get(model, self.requests_per_minute)
+                self._semaphores[model] = threading.BoundedSemaphore(concurrency)
+                # Allow a burst of up to one second's worth of requests (at least one)
+                self._buckets[model] = TokenBucket(rpm / 60.0, max(1.0, rpm / 60.0))
+                self._stats[model] = {'requests': 0, 'retries': 0, 'failures': 0, 'deadline_exceeded': 0, 'throttled_s': 0.0, 'in_flight': 0}
+            return self._semaphores[model], self._buckets[model], self._stats[model]
+
+    def _count(self, stats, name, amount=1):
+        with self._lock:
+            stats[name] += amount
+
+    def _backoff(self, attempt, error, deadline):
+        """Sleep before the next attempt: Retry-After if given, else full-jitter exponential"""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        response = getattr(error, 'response', None)
+        retry_after = response.headers.get('retry-after') if response is not None else None
+        if retry_after:
+            try:
+                delay = max(delay, float(retry_after))
+            except ValueError:
+                pass
+        if delay >= _remaining(deadline):
+            raise DeadlineExceeded("Backoff would exceed the deadline") from error
+        time.sleep(delay)
+
+    def _release(self, model):
+        semaphore, _, stats = self._limits(model)
+        self._count(stats, 'in_flight', -1)
+        semaphore.release()
+
+    def _call(self, model, request, deadline, keep_slot=False):
+        """Run request(timeout) under the model's limits, retrying transient failures
+
+        With keep_slot the model's concurrency slot is still held when a result
+        is returned, and the caller must give it back with _release.
+        """
+        semaphore, bucket, stats = self._limits(model)
+        try:
+            for attempt in range(self.max_retries + 1):
+                self._count(stats, 'throttled_s', bucket.acquire(deadline))
+                if not semaphore.acquire(timeout=_remaining(deadline)):
+                    raise DeadlineExceeded("Timed out waiting for a free LLM slot")
+                self._count(stats, 'in_flight')
+                self._count(stats, 'requests')
+                try:
+                    result = request(_remaining(deadline))
+                except RETRYABLE_ERRORS as error:
+                    self._release(model)
+                    if attempt == self.max_retries:
+                        self._count(stats, 'failures')
+                        raise
+                    self._count(stats, 'retries')
+                    self._backoff(attempt, error, deadline)
+                    continue
+                except BaseException:
+                    self._release(model)
+                    raise
+                if not keep_slot:
+                    self._release(model)
+                return result
+        except DeadlineExceeded:
+            self._count(stats, 'deadline_exceeded')
+            raise
+
+    def chat(self, model, messages, deadline=None, **kwargs):
+        """Create a chat completion and return the response object"""
+        return self._call(
+            model,
+            lambda timeout: self.client.chat.completions.create(model=model, messages=messages, timeout=timeout, **kwargs),
+            deadline or deadline_after(self.default_timeout)
+        )
+
+    def stream_chat(self, model, messages, deadline=None, **kwargs):
+        """Yield streamed chat completion chunks
+
+        Opening the stream is retried like any other call; once chunks have been
+        yielded, errors propagate because the partial reply was already used.
+        The model's concurrency slot is held until the stream is consumed.
+        """
+        stream = self._call(
+            model,
+            lambda timeout: self.client.chat.completions.create(model=model, messages=messages, stream=True, timeout=timeout, **kwargs),
+            deadline or deadline_after(self.default_timeout),
+            keep_slot=True
+        )
+        try:
+            yield from stream
+        finally:
+            self._release(model)
+
+    def embed(self, model, texts, deadline=None):
+        """Create embeddings for a batch of texts and return the response object"""
+        return self._call(
+            model,
+            lambda timeout: self.client.embeddings.create(model=model, input=texts, timeout=timeout),
+            deadline or deadline_after(self.default_timeout)
+        )
+
+    def stats(self):
+        """Per-model request, retry, failure and throttling counters"""
+        with self._lock:
+            return {model: {**stats, 'throttled_s': round(stats['throttled_s'], 2)} for model, stats in self._stats.items()}
+
+
+class FlightAbandoned(Exception):
+    """The leader of an in-flight request stopped before it had a result"""
+
+
+class _Flight:
+    """One in-flight request and the outcome its waiters receive"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.abandoned = False
+
+
+class SingleFlight:
+    """Coalesces concurrent identical requests into one
+
+    The first caller for a key becomes the leader and makes the request; callers
+    arriving while it is in flight wait for the leader's outcome instead of
+    sending their own. The key is forgotten as soon as the request finishes, so
+    later callers start a fresh request (or hit the reply cache). If the leader
+    is abandoned (e.g. its viewer navigated away mid-stream), waiters start
+    over and one of them becomes the new leader.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.shared = 0
+
+    def begin(self, key):
+        """Join or start the flight for key; returns (flight, is_leader)"""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.shared += 1
+                return flight, False
+            flight = self._flights[key] = _Flight()
+            self.leaders += 1
+            return flight, True
+
+    def finish(self, key, flight, result=None, error=None):
+        """Publish the leader's result (or error) to every waiter"""
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.result = result
+        flight.error = error
+        flight.done.set()
+
+    def abandon(self, key, flight):
+        """Release waiters without a result; they retry instead of failing"""
+        flight.abandoned = True
+        self.finish(key, flight)
+
+    def wait(self, flight, deadline=None):
+        """Block until the leader finishes and return its result, re-raising its error
+
+        Raises FlightAbandoned when the leader gave up, so the caller can retry.
+        """
+        timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+        if not flight.done.wait(timeout):
+            raise DeadlineExceeded("Deadline exceeded waiting for an identical in-flight request")
+        if flight.abandoned:
+            raise FlightAbandoned()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def do(self, key, request, deadline=None):
+        """Return request() for key, sharing one call among concurrent identical callers
+
+        Returns (result, shared) where shared tells whether the result came from
+        another caller's request.
+        """
+        while True:
+            flight, leader = self.begin(key)
+            if leader:
+                break
+            try:
+                return self.wait(flight, deadline), True
+            except FlightAbandoned:
+                continue
+        try:
+            result = request()
+        except Exception as error:
+            self.finish(key, flight, error=error)
+            raise
+        except BaseException:
+            self.abandon(key, flight)
+            raise
+        self.finish(key, flight, result)
+        return result, False
+
+    def stats(self):
+        """Requests started versus requests answered by joining an in-flight one"""
+        with self._lock:
+            return {'leaders': self.leaders, 'shared': self.shared, 'in_flight': len(self._flights)}
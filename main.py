@@ -2,21 +2,36 @@ import streamlit as st
 import os
 import requests
 from PIL import Image
-import pytesseract
 import openai
-import PyPDF2  # Add PyPDF2 for PDF extraction
-import io  # For handling byte streams
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from dotenv import load_dotenv
 from openai import OpenAI
+from chat_memory import build_messages as build_chat_messages, new_memory, summary_messages
+from document_analysis import legal_terms_messages, stream_analysis
+from document_store import load_analysis_history, load_text, should_spill, spill_text, text_digest
+from extraction_cache import ExtractionCache, content_key
+from llm_gateway import FlightAbandoned, LLMGateway, SingleFlight, deadline_after
+from llm_cache import DEFAULT_PATH as LLM_CACHE_DEFAULT_PATH, LLMResponseCache, request_key
+from image_ocr import DEFAULT_PRESET as OCR_PRESET, OCR_LANG, iter_frames, ocr_image, ocr_pages, preview_thumbnail
+from model_routing import ModelRouter
+from pdf_extraction import OCR_DPI, OCR_ENABLED, count_pdf_pages, iter_pdf_pages, join_pages, spooled_source
+from retrieval import TOP_K as RETRIEVAL_TOP_K, DocumentIndex, fits_in_context, format_passages, fuse_rankings
+from token_budget import TokenUsage, count_message_tokens, count_tokens, fit_messages, parse_model_limits
+from vector_index import EMBEDDING_MODEL, load_or_build as load_or_build_vectors
 
 # Load environment variables
 load_dotenv()
 api_key = os.getenv('OPENAI_API_KEY')
 maps_api_key = os.getenv('GOOGLE_MAPS_API_KEY')
 
-# Initialize OpenAI client
-client = OpenAI(api_key=api_key)
+# Point the app at a compatible stand-in (e.g. benchmarks/mock_openai_server.py) for offline runs
+openai_base_url = os.getenv('LEXIGUIDE_OPENAI_BASE_URL')
+
+# Initialize OpenAI client; retries are handled by the LLM gateway, so the SDK's own are off
+client = OpenAI(api_key=api_key or ("mock" if openai_base_url else None), base_url=openai_base_url, max_retries=0)
 
 # Page config
 st.set_page_config(
@@ -29,8 +44,14 @@ if 'show_chat' not in st.session_state:
     st.session_state.show_chat = False
 if 'chat_history' not in st.session_state:
     st.session_state.chat_history = []
+if 'chat_memory' not in st.session_state:
+    # Running summary of assistant turns that no longer fit the history budget
+    st.session_state.chat_memory = new_memory()
 if 'dictionary_history' not in st.session_state:
     st.session_state.dictionary_history = []
+if 'cached_definitions' not in st.session_state:
+    # Generated definitions keyed by term and legal context
+    st.session_state.cached_definitions = {}
 if 'feedback_submitted' not in st.session_state:
     st.session_state.feedback_submitted = False
 if 'current_document_text' not in st.session_state:
@@ -45,74 +66,497 @@ if 'feedback_data' not in st.session_state:
     }
 if 'all_feedback' not in st.session_state:
     st.session_state.all_feedback = []
+if 'qa_retrieval' not in st.session_state:
+    # Send only the most relevant passages with each question instead of the whole document
+    st.session_state.qa_retrieval = os.getenv('LEXIGUIDE_QA_RETRIEVAL', '1') != '0'
 
 # New session state variables for document storage
 if 'my_documents' not in st.session_state:
     st.session_state.my_documents = []
 if 'analysis_history' not in st.session_state:
-    st.session_state.analysis_history = []
-if 'current_analysis' not in st.session_state:
-    st.session_state.current_analysis = None
+    # Start from analyses produced offline by the batch pipeline, if any
+    st.session_state.analysis_history = load_analysis_history()
+if 'document_analyses' not in st.session_state:
+    # Analysis and legal terms per document, keyed by a hash of the document text
+    st.session_state.document_analyses = {}
 if 'current_document_name' not in st.session_state:
     st.session_state.current_document_name = ""
 
-# Check API keys
-if not api_key or not maps_api_key:
+# Width of the uploaded image preview, in pixels
+PREVIEW_WIDTH = 400
+
+# Check API keys; no OpenAI key is needed when a stand-in base URL is set
+if not (api_key or openai_base_url) or not maps_api_key:
     st.error("Please make sure both OpenAI and Google Maps API keys are set in your .env file")
     st.stop()
 
+@st.cache_resource
+def get_extraction_cache():
+    """Process-wide extraction cache shared by all sessions"""
+    max_mb = int(os.getenv('LEXIGUIDE_EXTRACTION_CACHE_MB', '64'))
+    return ExtractionCache(
+        max_chars=max_mb * 1024 * 1024,
+        disk_dir=os.getenv('LEXIGUIDE_EXTRACTION_CACHE_DIR')
+    )
+
 def extract_text_from_image(image):
-    img = Image.open(image)
-    text = pytesseract.image_to_string(img)
-    return text if text else ""
+    # Accept an already-decoded image so callers don't have to decode the upload twice
+    img = image if isinstance(image, Image.Image) else Image.open(image)
+    # Grayscale, downscale, deskew and binarize according to the configured preset
+    return ocr_image(img, OCR_PRESET)
 
-def extract_text_from_pdf(pdf_file):
-    """Extract text from a PDF file"""
-    text = ""
-    try:
-        # Create a PDF reader object
-        pdf_bytes = io.BytesIO(pdf_file.read())
-        pdf_reader = PyPDF2.PdfReader(pdf_bytes)
-        
-        # Extract text from each page
-        for page_num in range(len(pdf_reader.pages)):
-            page = pdf_reader.pages[page_num]
-            text += page.extract_text() + "\n\n"
-        
+def natural_sort_key(name):
+    """Sort key that orders page_2.jpg before page_10.jpg"""
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r'(\d+)', name)]
+
+def extract_images_with_preview(uploaded_files, settings):
+    """Extract text from one or more uploaded images as a single document
+
+    Each frame of a multi-page TIFF counts as a page. Pages are OCR'd
+    concurrently and joined in page order. Returns the text, a thumbnail of the
+    first page and the page count. The uploads are decoded at most once per
+    rerun, and not at all when the text and thumbnail are already cached.
+    """
+    cache = get_extraction_cache()
+    # getbuffer() hashes Streamlit's buffer in place rather than copying it
+    key = content_key([f.getbuffer() for f in uploaded_files], settings)
+    text = cache.get(key)
+    preview = st.session_state.get('image_preview')
+    has_thumbnail = preview is not None and preview['key'] == key
+
+    if text is None or not has_thumbnail:
+        pages = []
+        for uploaded_file in uploaded_files:
+            pages.extend(iter_frames(Image.open(uploaded_file)))
+            uploaded_file.seek(0)
+        if text is None:
+            if len(pages) == 1:
+                text = extract_text_from_image(pages[0])
+            else:
+                text = join_pages(ocr_pages(pages, OCR_PRESET))
+            # Empty results are not cached so failed extractions get retried
+            if text.strip():
+                cache.put(key, text)
+        if not has_thumbnail:
+            st.session_state.image_preview = {
+                'key': key,
+                'thumbnail': preview_thumbnail(pages[0], PREVIEW_WIDTH),
+                'page_count': len(pages)
+            }
+
+    preview = st.session_state.image_preview
+    return text, preview['thumbnail'], preview['page_count']
+
+def extract_pdf_with_preview(uploaded_file, settings):
+    """Extract a PDF page by page, showing progress and a growing preview as pages complete"""
+    cache = get_extraction_cache()
+    with uploaded_file.getbuffer() as view:
+        key = content_key(view, settings)
+    text = cache.get(key)
+    if text is not None:
         return text
+
+    progress = st.progress(0.0, text="Extracting pages...")
+    preview = st.empty()
+    preview_text = ""
+    pages = []
+    # The Q&A index is built page by page while extraction is still running
+    index = DocumentIndex()
+    try:
+        with spooled_source(uploaded_file) as source:
+            page_count = count_pdf_pages(source)
+            for page_no, page_text in iter_pdf_pages(source):
+                pages.append(page_text)
+                index.add_text(page_text)
+                progress.progress(page_no / page_count, text=f"Extracted page {page_no} of {page_count}")
+                # Only the first 500 characters are previewed, so stop redrawing once they are filled
+                if len(preview_text) < 500:
+                    preview_text = join_pages(pages)[:500]
+                    preview.text(preview_text)
     except Exception as e:
         st.error(f"Error extracting text from PDF: {str(e)}")
-        return ""
-
-def analyze_legal_document(text):
-    # Only call API if analysis doesn't exist or needs to be refreshed
-    if st.session_state.current_analysis is None:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": "You are a legal document analyzer. Provide a clear summary, highlight key points, and explain important legal terms used."},
-                {"role": "user", "content": f"Analyze this legal document and provide: 1) A summary 2) Key points 3) Legal terms used with their explanations:\n\n{text}"}
-            ]
+        pages = []
+    finally:
+        progress.empty()
+        preview.empty()
+
+    text = join_pages(pages)
+    if text.strip():
+        cache.put(key, text)
+        store_document_index(document_analysis_entry(text), index)
+    return text
+
+@st.cache_resource
+def get_llm_cache():
+    """Disk-backed LLM reply cache shared by all sessions"""
+    return LLMResponseCache(
+        path=os.getenv('LEXIGUIDE_LLM_CACHE_PATH', LLM_CACHE_DEFAULT_PATH),
+        ttl_seconds=float(os.getenv('LEXIGUIDE_LLM_CACHE_TTL_HOURS', '168')) * 3600,
+        max_bytes=int(os.getenv('LEXIGUIDE_LLM_CACHE_MB', '256')) * 1024 * 1024
+    )
+
+@st.cache_resource
+def get_token_usage():
+    """Process-wide record of tokens in/out and latency per model"""
+    return TokenUsage()
+
+@st.cache_resource
+def get_llm_gateway():
+    """Per-model concurrency and rate limits, retries and deadlines shared by all sessions"""
+    return LLMGateway(
+        client,
+        max_concurrency=int(os.getenv('LEXIGUIDE_LLM_MAX_CONCURRENCY', '8')),
+        requests_per_minute=float(os.getenv('LEXIGUIDE_LLM_RPM', '500')),
+        max_retries=int(os.getenv('LEXIGUIDE_LLM_MAX_RETRIES', '5')),
+        default_timeout=float(os.getenv('LEXIGUIDE_LLM_TIMEOUT_S', '60')),
+        concurrency_overrides=parse_model_limits(os.getenv('LEXIGUIDE_LLM_MODEL_CONCURRENCY')),
+        rpm_overrides=parse_model_limits(os.getenv('LEXIGUIDE_LLM_MODEL_RPM'))
+    )
+
+@st.cache_resource
+def get_model_router():
+    """Routing policy and per-route latency and token metrics shared by all sessions"""
+    return ModelRouter()
+
+@st.cache_resource
+def get_inflight_requests():
+    """Identical LLM requests currently in flight, shared by all sessions"""
+    return SingleFlight()
+
+# Resolved on the script thread so worker threads never touch the Streamlit cache machinery
+llm_cache = get_llm_cache()
+token_usage = get_token_usage()
+llm_gateway = get_llm_gateway()
+inflight_requests = get_inflight_requests()
+model_router = get_model_router()
+
+# Overall time allowed for one document analysis, shared by all of its chunk requests
+ANALYSIS_DEADLINE_S = float(os.getenv('LEXIGUIDE_ANALYSIS_DEADLINE_S', '300'))
+
+def record_usage(route, model, prompt_tokens, completion_tokens, latency, cached=False, shared=False, trimmed=False):
+    """Record a call in the per-model token usage and, for routed calls, the per-route metrics"""
+    token_usage.record(model, prompt_tokens, completion_tokens, latency, cached=cached, trimmed=trimmed, shared=shared)
+    if route:
+        model_router.record(route, model, prompt_tokens, completion_tokens, latency, cached=cached or shared)
+
+def chat_completion(model, messages, deadline=None, route=None):
+    """Send a chat completion request and return the reply text
+
+    The prompt is trimmed to the model's token budget. Identical requests (same
+    model and messages) are answered from the shared LLM cache instead of
+    calling the API again, and concurrent identical requests share one call.
+    Tokens and latency are recorded for every call.
+    deadline is an absolute time.monotonic() value; by default each call gets
+    the gateway's own timeout. route is the routing decision the model came
+    from (see model_routing), for the per-route metrics.
+    """
+    start = time.perf_counter()
+    fitted = fit_messages(messages, model)
+    key = request_key(model, fitted)
+    cached = llm_cache.get(key)
+    if cached is not None:
+        record_usage(route, model, 0, 0, time.perf_counter() - start, cached=True)
+        return cached
+
+    def request():
+        response = llm_gateway.chat(model, fitted, deadline)
+        content = response.choices[0].message.content
+        usage = response.usage
+        record_usage(
+            route,
+            model,
+            usage.prompt_tokens if usage else count_message_tokens(fitted, model),
+            usage.completion_tokens if usage else count_tokens(content, model),
+            time.perf_counter() - start,
+            trimmed=fitted is not messages
         )
-        analysis_result = response.choices[0].message.content
-        st.session_state.current_analysis = analysis_result
-    
-    return st.session_state.current_analysis
-
-def extract_legal_terms(text):
-    # Check if we need to extract terms or can use cached data
-    if 'current_legal_terms' not in st.session_state:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": "You are a legal terminology expert. Extract and explain legal terms from the document."},
-                {"role": "user", "content": f"Extract all legal terms from this document and provide their definitions in simple language:\n\n{text}"}
-            ]
+        llm_cache.put(key, model, content)
+        return content
+
+    # Concurrent identical requests (e.g. the same template uploaded by several users) share one call
+    content, shared = inflight_requests.do(key, request, deadline)
+    if shared:
+        record_usage(route, model, 0, 0, time.perf_counter() - start, shared=True)
+    return content
+
+def stream_chat_completion(model, messages, deadline=None, route=None):
+    """Yield the reply text in pieces as the model generates it
+
+    A cached reply is yielded in one piece; a freshly streamed one is cached
+    once it is complete. Prompts are trimmed and usage recorded as in
+    chat_completion. A caller whose request is identical to one already
+    streaming receives that reply in one piece when it completes.
+    """
+    start = time.perf_counter()
+    fitted = fit_messages(messages, model)
+    key = request_key(model, fitted)
+    cached = llm_cache.get(key)
+    if cached is not None:
+        record_usage(route, model, 0, 0, time.perf_counter() - start, cached=True)
+        yield cached
+        return
+
+    while True:
+        flight, leader = inflight_requests.begin(key)
+        if leader:
+            break
+        try:
+            # An identical request is already streaming; wait for its full reply
+            content = inflight_requests.wait(flight, deadline)
+        except FlightAbandoned:
+            # Its leader was closed mid-stream; start over, possibly as the new leader
+            continue
+        record_usage(route, model, 0, 0, time.perf_counter() - start, shared=True)
+        yield content
+        return
+
+    parts = []
+    usage = None
+    try:
+        stream = llm_gateway.stream_chat(model, fitted, deadline, stream_options={"include_usage": True})
+        for chunk in stream:
+            # The final chunk carries usage and no choices
+            if chunk.usage:
+                usage = chunk.usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                parts.append(chunk.choices[0].delta.content)
+                yield parts[-1]
+    except Exception as e:
+        inflight_requests.finish(key, flight, error=e)
+        raise
+    except BaseException:
+        # Closed mid-stream (e.g. a rerun); waiters retry rather than see an error
+        inflight_requests.abandon(key, flight)
+        raise
+
+    content = "".join(parts)
+    try:
+        record_usage(
+            route,
+            model,
+            usage.prompt_tokens if usage else count_message_tokens(fitted, model),
+            usage.completion_tokens if usage else count_tokens(content, model),
+            time.perf_counter() - start,
+            trimmed=fitted is not messages
         )
-        terms_result = response.choices[0].message.content
-        st.session_state.current_legal_terms = terms_result
-    
-    return st.session_state.current_legal_terms
+        # Cache before releasing waiters so a request arriving in between hits the cache
+        llm_cache.put(key, model, content)
+    finally:
+        # The reply is complete even if bookkeeping failed; never leave waiters blocked
+        inflight_requests.finish(key, flight, content)
+
+def routed_completion(task, messages, deadline=None, document_tokens=None):
+    """chat_completion on the model the router picks for this task"""
+    route, model = model_router.choose(task, messages, document_tokens)
+    return chat_completion(model, messages, deadline, route)
+
+def routed_stream(task, messages, deadline=None, document_tokens=None):
+    """stream_chat_completion on the model the router picks for this task"""
+    route, model = model_router.choose(task, messages, document_tokens)
+    return stream_chat_completion(model, messages, deadline, route)
+
+def write_assistant_reply(history, task, build_messages, document_tokens=None):
+    """Stream a reply into the current container and append it to history
+
+    build_messages() is called here too, so an API error while building the
+    request (e.g. summarizing the history) is shown as the reply like any other.
+    """
+    st.markdown("**Assistant:**")
+    try:
+        reply = st.write_stream(routed_stream(task, build_messages(), document_tokens=document_tokens))
+    except Exception as e:
+        reply = f"Sorry, I encountered an error: {str(e)}"
+        st.markdown(reply)
+    history.append({
+        "role": "assistant",
+        "content": reply
+    })
+
+@st.cache_resource
+def get_llm_executor():
+    """Thread pool used to issue independent LLM requests concurrently"""
+    return ThreadPoolExecutor(max_workers=int(os.getenv('LEXIGUIDE_LLM_THREADS', '8')))
+
+def compute_legal_terms(text):
+    """Request the legal terms glossary; safe to run outside the script thread"""
+    return routed_completion('legal_terms', legal_terms_messages(text), document_tokens=count_tokens(text))
+
+# Number of documents whose analyses are kept per session
+MAX_CACHED_ANALYSES = 32
+# Characters of passages the session's retrieval indexes may hold in total; each
+# index keeps its own copy of the document text. Beyond this, the indexes of the
+# least recently used documents are dropped and rebuilt if those are opened again.
+MAX_CACHED_INDEX_CHARS = int(os.getenv('LEXIGUIDE_MAX_CACHED_INDEX_CHARS', '2000000'))
+
+def document_analysis_entry(text):
+    """Return the per-session analysis cache entry for a document's content
+
+    The entry holds 'analysis' and 'legal_terms' once computed. Keying on the
+    content hash means switching back to a document reuses its results, and a
+    different document never sees another one's results.
+    """
+    analyses = st.session_state.document_analyses
+    digest = text_digest(text)
+    # Most recently used last
+    entry = analyses.pop(digest, None)
+    analyses[digest] = {} if entry is None else entry
+    # Drop the least recently used entries beyond the limit
+    while len(analyses) > MAX_CACHED_ANALYSES:
+        del analyses[next(iter(analyses))]
+    return analyses[digest]
+
+def current_document_analysis():
+    """Analysis cache entry for the currently loaded document (empty if none)"""
+    if not st.session_state.current_document_text:
+        return {}
+    return document_analysis_entry(st.session_state.current_document_text)
+
+def current_document_tokens():
+    """Token count of the loaded document, for routing questions about it (0 if none)
+
+    Questions are sent with a few excerpts, so routing on the prompt alone
+    would treat every document as short.
+    """
+    if not st.session_state.current_document_text:
+        return 0
+    entry = current_document_analysis()
+    if 'tokens' not in entry:
+        entry['tokens'] = count_tokens(st.session_state.current_document_text)
+    return entry['tokens']
+
+def document_index(text):
+    """Return the retrieval index of a document, building it on first use
+
+    The index is stored with the document's other per-content results, so it
+    is built once per document and reused across questions and reloads.
+    """
+    entry = document_analysis_entry(text)
+    if 'index' not in entry:
+        store_document_index(entry, DocumentIndex(text))
+    return entry['index']
+
+def store_document_index(entry, index):
+    """Keep a document's retrieval index in its cache entry, within MAX_CACHED_INDEX_CHARS
+
+    Indexes of the least recently used documents are dropped, with the
+    embeddings that share their passages, until the session's indexes fit.
+    """
+    entry['index'] = index
+    entry['index_chars'] = sum(len(chunk) for chunk in index.chunks)
+    analyses = st.session_state.document_analyses
+    total = sum(other['index_chars'] for other in analyses.values() if 'index' in other)
+    for other in analyses.values():
+        if total <= MAX_CACHED_INDEX_CHARS:
+            break
+        if other is not entry and 'index' in other:
+            total -= other.pop('index_chars')
+            del other['index']
+            other.pop('vectors', None)
+
+# 'hybrid' fuses keyword (BM25) and embedding retrieval; 'bm25' uses keywords only
+RETRIEVAL_MODE = os.getenv('LEXIGUIDE_RETRIEVAL_MODE', 'hybrid')
+
+def embed_texts(texts):
+    """Embed a batch of texts with a single API request"""
+    response = llm_gateway.embed(EMBEDDING_MODEL, texts)
+    return [item.embedding for item in response.data]
+
+def document_vectors(text, wait=False):
+    """Return the document's embedding index, or None when semantic retrieval is off, not ready or unavailable
+
+    The passages of the keyword index are embedded in the background on the
+    LLM thread pool; with wait, a pending embedding is waited for. Embeddings
+    are saved next to the document, so reloading the same content reuses them.
+    """
+    if RETRIEVAL_MODE != 'hybrid':
+        return None
+    entry = document_analysis_entry(text)
+    if 'vectors' not in entry:
+        chunks = list(document_index(text).chunks)
+        entry['vectors'] = get_llm_executor().submit(load_or_build_vectors, text_digest(text), chunks, embed_texts)
+    future = entry['vectors']
+    if not (wait or future.done()):
+        return None
+    try:
+        return future.result()
+    except Exception:
+        # Keyword retrieval still works without the embeddings API; a later call tries again
+        entry.pop('vectors', None)
+        return None
+
+def retrieve_passages(text, question, k=RETRIEVAL_TOP_K):
+    """Return the passages most relevant to question, in document order"""
+    index = document_index(text)
+    keyword_ranking = [i for i, _ in index.search(question, 2 * k)]
+    ranking = keyword_ranking[:k]
+
+    vectors = document_vectors(text, wait=True)
+    if vectors is not None:
+        try:
+            query_vector = embed_texts([question])[0]
+            semantic_ranking = [i for i, _ in vectors.search(query_vector, 2 * k)]
+            ranking = fuse_rankings([keyword_ranking, semantic_ranking], k)
+        except Exception:
+            pass
+
+    return [index.chunks[i] for i in sorted(ranking)]
+
+def document_context(question):
+    """Document text to send with a question: relevant passages, or the full text
+
+    Falls back to the full document when retrieval is switched off or the
+    document is no larger than the passages retrieval would send anyway.
+    """
+    text = st.session_state.current_document_text
+    if not st.session_state.qa_retrieval or fits_in_context(text):
+        return f"Document: {text}\n"
+    passages = retrieve_passages(text, question)
+    if not passages:
+        return "No passages of the document matched this question.\n"
+    return f"Relevant excerpts from the document:\n{format_passages(passages)}\n"
+
+def start_document_analysis(text):
+    """Start the legal terms request in the background if it is still missing
+
+    The analysis itself is streamed on the script thread by
+    finish_document_analysis while the terms request runs. Returns the
+    document's cache entry and a dict mapping each entry key still to be
+    filled in the background to its future.
+    """
+    entry = document_analysis_entry(text)
+    pending = {}
+    if 'legal_terms' not in entry:
+        pending['legal_terms'] = get_llm_executor().submit(compute_legal_terms, text)
+    return entry, pending
+
+def finish_document_analysis(text, entry, pending, slots):
+    """Stream the analysis into its placeholder and render background results as they land"""
+    def render_ready():
+        for key, future in list(pending.items()):
+            if future.done():
+                entry[key] = future.result()
+                slots[key].write(entry[key])
+                del pending[key]
+
+    if 'analysis' not in entry:
+        def analysis_pieces():
+            deadline = deadline_after(ANALYSIS_DEADLINE_S)
+            document_tokens = count_tokens(text)
+            complete = lambda messages: routed_completion('chunk_summary', messages, deadline)
+            stream = lambda messages: routed_stream('analysis', messages, deadline, document_tokens)
+            for piece in stream_analysis(text, complete, stream):
+                # Show the glossary as soon as it lands, even mid-stream
+                render_ready()
+                yield piece
+
+        with slots['analysis'].container():
+            entry['analysis'] = st.write_stream(analysis_pieces())
+
+    keys = {future: key for key, future in pending.items()}
+    for future in as_completed(keys):
+        key = keys[future]
+        entry[key] = future.result()
+        slots[key].write(entry[key])
 
 # RAG Implementation for Legal Dictionary
 def fetch_definition_from_api(term):
@@ -150,17 +594,8 @@ def fetch_definition_from_api(term):
             'message': f"Error fetching definition: {str(e)}"
         }
 
-def augment_definition_with_llm(term, api_result, is_legal_context=True):
-    """Step 2: Augment - Use LLM to enhance, simplify, or add legal context"""
-    
-    # Check if we already have this definition cached
-    term_key = f"{term}_{is_legal_context}"
-    if 'cached_definitions' not in st.session_state:
-        st.session_state.cached_definitions = {}
-    
-    if term_key in st.session_state.cached_definitions:
-        return st.session_state.cached_definitions[term_key]
-    
+def definition_messages(term, api_result, is_legal_context):
+    """Step 2: Augment - Build the LLM request that enhances, simplifies or adds legal context"""
     # Prepare context from API result
     context = ""
     if api_result['found']:
@@ -196,27 +631,10 @@ Please provide:
 2. A simplified explanation in plain language
 3. 1-2 example sentences showing how this term is used"""
 
-    try:
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ]
-        )
-        result = {
-            'augmented_definition': response.choices[0].message.content,
-            'source': 'API + LLM' if api_result['found'] else 'LLM only'
-        }
-        
-        # Cache the result
-        st.session_state.cached_definitions[term_key] = result
-        return result
-    except Exception as e:
-        return {
-            'augmented_definition': f"Error generating definition: {str(e)}",
-            'source': 'Error'
-        }
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
 
 def generate_definition_output(term, augmented_result):
     """Step 3: Generate - Format and display the final result"""
@@ -225,6 +643,30 @@ def generate_definition_output(term, augmented_result):
     st.markdown(augmented_result['augmented_definition'])
     st.markdown("---")
 
+def stream_definition_output(term, is_legal_context=True):
+    """Retrieve, augment and display a definition, streaming the LLM output as it arrives
+
+    Previously generated definitions are shown straight from the session cache.
+    """
+    term_key = f"{term}_{is_legal_context}"
+    if term_key in st.session_state.cached_definitions:
+        generate_definition_output(term, st.session_state.cached_definitions[term_key])
+        return
+
+    api_result = fetch_definition_from_api(term)
+    source = 'API + LLM' if api_result['found'] else 'LLM only'
+    st.subheader(f"Definition: {term}")
+    st.caption(f"Source: {source}")
+    try:
+        definition = st.write_stream(routed_stream('definition', definition_messages(term, api_result, is_legal_context)))
+        st.session_state.cached_definitions[term_key] = {
+            'augmented_definition': definition,
+            'source': source
+        }
+    except Exception as e:
+        st.markdown(f"Error generating definition: {str(e)}")
+    st.markdown("---")
+
 def toggle_chat():
     st.session_state.show_chat = not st.session_state.show_chat
 
@@ -232,80 +674,61 @@ def toggle_chat():
 def submit_doc_question():
     user_question = st.session_state.doc_question_input
     if user_question:
-        # Add user question to doc chat history
+        # Add user question to doc chat history; the answer is streamed where the conversation is shown
         st.session_state.doc_chat_history.append({
             "role": "user", 
             "content": user_question
         })
         
-        # Get AI response for document context
-        try:
-            response = client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "You are a helpful legal assistant. Answer questions about this document clearly and concisely."},
-                    {"role": "user", "content": f"Document: {st.session_state.current_document_text}\nQuestion: {user_question}"}
-                ]
-            )
-            assistant_response = response.choices[0].message.content
-            
-            # Add assistant response to doc chat history
-            st.session_state.doc_chat_history.append({
-                "role": "assistant", 
-                "content": assistant_response
-            })
-        except Exception as e:
-            st.session_state.doc_chat_history.append({
-                "role": "assistant", 
-                "content": f"Sorry, I encountered an error: {str(e)}"
-            })
-        
         # Clear the input
         st.session_state.doc_question_input = ""
 
 def submit_chat_question():
     user_question = st.session_state.chat_input
     if user_question:
-        # Add user message to chat history
+        # Add user message to chat history; the answer is streamed where the chat is shown
         st.session_state.chat_history.append({
             "role": "user", 
             "content": user_question
         })
         
-        # Generate context based on whether we have document text
-        context = f"Document: {st.session_state.current_document_text}\n" if st.session_state.current_document_text else "No document is currently loaded. "
-        
-        # Get AI response
-        try:
-            response = client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "You are a helpful legal assistant. Answer questions clearly and concisely."},
-                    {"role": "user", "content": f"{context}Question: {user_question}"}
-                ]
-            )
-            assistant_response = response.choices[0].message.content
-            
-            # Add assistant response to chat history
-            st.session_state.chat_history.append({
-                "role": "assistant", 
-                "content": assistant_response
-            })
-        except Exception as e:
-            # Handle API errors
-            st.session_state.chat_history.append({
-                "role": "assistant", 
-                "content": f"Sorry, I encountered an error: {str(e)}"
-            })
-        
         # Clear the input
         st.session_state.chat_input = ""
 
+def doc_question_messages(user_question):
+    """Build the LLM request answering a question about the current document"""
+    return [
+        {"role": "system", "content": "You are a helpful legal assistant. Answer questions about this document clearly and concisely. If you are given excerpts and they do not contain the answer, say so."},
+        {"role": "user", "content": f"{document_context(user_question)}Question: {user_question}"}
+    ]
+
+def chat_question_messages(user_question):
+    """Build the LLM request answering a question to the sidebar assistant
+
+    Earlier turns are included under a fixed token budget; older ones are
+    folded into a running summary so the cost per turn stays flat.
+    """
+    # Generate context based on whether we have document text
+    context = document_context(user_question) if st.session_state.current_document_text else "No document is currently loaded. "
+    return build_chat_messages(
+        "You are a helpful legal assistant. Answer questions clearly and concisely.",
+        st.session_state.chat_history[:-1],
+        f"{context}Question: {user_question}",
+        st.session_state.chat_memory,
+        lambda summary, turns: routed_completion('chat_summary', summary_messages(summary, turns)),
+        # Budget the history for the model a chat turn is routed to
+        model_router.choose('chat', document_tokens=current_document_tokens())[1]
+    )
+
+def has_unanswered_question(history):
+    return bool(history) and history[-1]["role"] == "user"
+
 def clear_doc_chat():
     st.session_state.doc_chat_history = []
 
 def clear_chat():
     st.session_state.chat_history = []
+    st.session_state.chat_memory = new_memory()
 
 def submit_feedback():
     if 'feedback_rating' in st.session_state and 'feedback_text' in st.session_state and 'feedback_satisfaction' in st.session_state:
@@ -319,7 +742,7 @@ def submit_feedback():
         st.session_state.feedback_submitted = True
         
         # Add feedback to the current analysis history
-        if st.session_state.current_analysis and st.session_state.current_document_name:
+        if current_document_analysis().get('analysis') and st.session_state.current_document_name:
             for item in st.session_state.analysis_history:
                 if item['document_name'] == st.session_state.current_document_name:
                     if 'feedback' not in item:
@@ -336,12 +759,16 @@ def save_document():
         st.warning("No document to save or missing document name")
         return
     
+    # Large documents are kept on disk so saved documents don't stay resident per session
+    text = st.session_state.current_document_text
+    stored_text = {'text': None, 'text_id': spill_text(text)} if should_spill(text) else {'text': text, 'text_id': None}
+
     # Check if document already exists
     doc_exists = False
     for doc in st.session_state.my_documents:
         if doc['name'] == st.session_state.current_document_name:
             doc_exists = True
-            doc['text'] = st.session_state.current_document_text
+            doc.update(stored_text)
             doc['last_modified'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             st.success(f"Updated document: {st.session_state.current_document_name}")
             break
@@ -350,19 +777,20 @@ def save_document():
         # Add new document
         st.session_state.my_documents.append({
             'name': st.session_state.current_document_name,
-            'text': st.session_state.current_document_text,
+            **stored_text,
             'date_added': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
             'last_modified': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         })
         st.success(f"Saved document: {st.session_state.current_document_name}")
     
     # Also save to analysis history if we have an analysis
-    if st.session_state.current_analysis:
+    if current_document_analysis().get('analysis'):
         save_analysis()
 
 def save_analysis():
     """Save current analysis to Analysis History"""
-    if not st.session_state.current_analysis or not st.session_state.current_document_name:
+    entry = current_document_analysis()
+    if not entry.get('analysis') or not st.session_state.current_document_name:
         return
     
     # Check if analysis already exists
@@ -370,8 +798,8 @@ def save_analysis():
     for analysis in st.session_state.analysis_history:
         if analysis['document_name'] == st.session_state.current_document_name:
             analysis_exists = True
-            analysis['analysis'] = st.session_state.current_analysis
-            analysis['legal_terms'] = st.session_state.current_legal_terms if 'current_legal_terms' in st.session_state else ""
+            analysis['analysis'] = entry['analysis']
+            analysis['legal_terms'] = entry.get('legal_terms', "")
             analysis['last_analyzed'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             break
     
@@ -379,27 +807,42 @@ def save_analysis():
         # Add new analysis
         st.session_state.analysis_history.append({
             'document_name': st.session_state.current_document_name,
-            'analysis': st.session_state.current_analysis,
-            'legal_terms': st.session_state.current_legal_terms if 'current_legal_terms' in st.session_state else "",
+            'analysis': entry['analysis'],
+            'legal_terms': entry.get('legal_terms', ""),
             'date_analyzed': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
             'last_analyzed': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
             'feedback': []
         })
 
 def load_document(document_name):
-    """Load a document from My Documents"""
+    """Load a document from My Documents, or one analyzed by the batch pipeline"""
     for doc in st.session_state.my_documents:
         if doc['name'] == document_name:
-            st.session_state.current_document_text = doc['text']
-            st.session_state.current_document_name = doc['name']
-            # Reset analysis to force reanalysis
-            st.session_state.current_analysis = None
-            if 'current_legal_terms' in st.session_state:
-                del st.session_state.current_legal_terms
-            # Clear document Q&A
-            st.session_state.doc_chat_history = []
-            return True
-    return False
+            text = doc['text'] if doc['text'] is not None else load_text(doc['text_id'])
+            break
+    else:
+        # Batch analyses keep their text in the document store rather than in My Documents
+        analysis = next((a for a in st.session_state.analysis_history
+                         if a['document_name'] == document_name and a.get('text_id')), None)
+        if analysis is None:
+            return False
+        try:
+            text = load_text(analysis['text_id'])
+        except OSError:
+            return False
+        entry = document_analysis_entry(text)
+        entry.setdefault('analysis', analysis['analysis'])
+        entry.setdefault('legal_terms', analysis.get('legal_terms', ""))
+
+    st.session_state.current_document_text = text
+    st.session_state.current_document_name = document_name
+    # Analyses are cached per document content, so a previously analyzed document is not re-analyzed
+    document_index(text)
+    # Embedded in the background; the first question waits for it if needed
+    document_vectors(text)
+    # Clear document Q&A
+    st.session_state.doc_chat_history = []
+    return True
 
 def render_chat_ui():
     # Chat header
@@ -433,6 +876,9 @@ def render_chat_ui():
                 st.markdown(f"<div class='user-message'><strong>You:</strong> {chat['content']}</div>", unsafe_allow_html=True)
             else:
                 st.markdown(f"<div class='assistant-message'><strong>Assistant:</strong> {chat['content']}</div>", unsafe_allow_html=True)
+        # Stream the answer to a question submitted since the last run
+        if has_unanswered_question(st.session_state.chat_history):
+            write_assistant_reply(st.session_state.chat_history, 'chat', lambda: chat_question_messages(st.session_state.chat_history[-1]["content"]), current_document_tokens())
     
     # Chat input and buttons
     st.text_input("Ask a question", key="chat_input", on_change=submit_chat_question)
@@ -453,6 +899,19 @@ def main():
         if st.button("💬 Chat Assistant", use_container_width=True, 
                      help="Open AI Assistant to ask questions"):
             toggle_chat()
+        with st.expander("Performance Metrics"):
+            st.caption("Extraction cache")
+            st.json(get_extraction_cache().stats())
+            st.caption("LLM response cache")
+            st.json(llm_cache.stats())
+            st.caption("LLM tokens and latency per model")
+            st.json(token_usage.summary())
+            st.caption("LLM gateway requests, retries and throttling per model")
+            st.json(llm_gateway.stats())
+            st.caption("Identical in-flight requests coalesced")
+            st.json(inflight_requests.stats())
+            st.caption(f"Model routes ({model_router.policy} policy): calls, tokens, cost and latency")
+            st.json(model_router.summary())
     
     # Main navigation menu
     with st.sidebar:
@@ -467,39 +926,49 @@ def main():
     
     if menu == "Upload Document":
         st.write("Upload your legal document for AI-powered analysis and recommendations")
-        uploaded_file = st.file_uploader("Upload your legal document", type=["pdf", "png", "jpg", "jpeg"])
+        uploaded_files = st.file_uploader(
+            "Upload your legal document",
+            type=["pdf", "png", "jpg", "jpeg", "tif", "tiff"],
+            accept_multiple_files=True,
+            help="Upload a single PDF, or one or more page images. Multiple images and multi-page TIFFs are combined into one document."
+        )
         
         # Document name input field
         document_name = st.text_input("Document Name", value=st.session_state.current_document_name)
         if document_name:
             st.session_state.current_document_name = document_name
 
-        if uploaded_file:
+        if uploaded_files:
+            # Page images are combined in filename order (page_2 before page_10)
+            uploaded_files = sorted(uploaded_files, key=lambda f: natural_sort_key(f.name))
+            uploaded_file = uploaded_files[0]
             with st.spinner("Processing document..."):
                 # Check file type and process accordingly
-                if uploaded_file.type.startswith('image'):
-                    text = extract_text_from_image(uploaded_file)
+                if all(f.type.startswith('image') for f in uploaded_files):
+                    text, thumbnail, page_count = extract_images_with_preview(uploaded_files, {'extractor': 'tesseract', 'preset': OCR_PRESET, 'lang': OCR_LANG})
                     st.session_state.current_document_text = text
                     
                     # Show preview of the image
                     st.subheader("Document Preview")
-                    image = Image.open(uploaded_file)
-                    st.image(image, width=400)
+                    st.image(thumbnail, width=PREVIEW_WIDTH)
+                    if page_count > 1:
+                        st.caption(f"Page 1 of {page_count}")
                     
-                elif uploaded_file.type == "application/pdf":
-                    text = extract_text_from_pdf(uploaded_file)
+                elif len(uploaded_files) == 1 and uploaded_file.type == "application/pdf":
+                    st.subheader("Document Preview")
+                    # Pages are previewed as they are extracted rather than after the whole file
+                    text = extract_pdf_with_preview(uploaded_file, {'extractor': 'pypdf2', 'ocr': OCR_ENABLED, 'ocr_dpi': OCR_DPI, 'lang': OCR_LANG})
                     st.session_state.current_document_text = text
                     
                     # Show notification that PDF was processed
-                    st.subheader("Document Preview")
                     st.success(f"PDF document processed successfully")
                     # Display first 500 characters as preview
                     if len(text) > 0:
                         st.text_area("Document Content Preview", text[:500] + "...", height=200)
                     else:
-                        st.warning("No text could be extracted from the PDF. It may be scanned or contain only images.")
+                        st.warning("No text could be extracted from the PDF, even with OCR. It may contain only images without legible text.")
                 else:
-                    st.error("Unsupported file type. Please upload a PDF or image file.")
+                    st.error("Unsupported upload. Please upload a single PDF, or one or more image files.")
                     st.session_state.current_document_text = ""
 
                 # Set default name if not provided
@@ -512,24 +981,33 @@ def main():
                         save_document()
 
                 if st.session_state.current_document_text:
-                    # Call analysis function - caching handled inside
-                    analysis = analyze_legal_document(st.session_state.current_document_text)
+                    # Summary and glossary are requested in parallel; cached results are reused
+                    entry, pending = start_document_analysis(st.session_state.current_document_text)
+                    # Build the Q&A keyword index now and start embedding its passages in the background
+                    document_index(st.session_state.current_document_text)
+                    document_vectors(st.session_state.current_document_text)
 
                     col1, col2 = st.columns(2)
 
                     with col1:
                         st.subheader("Document Summary")
-                        st.write(analysis)
+                        slots = {'analysis': st.empty()}
                         
                         st.subheader("Legal Terms Glossary")
-                        legal_terms = extract_legal_terms(st.session_state.current_document_text)
-                        st.write(legal_terms)
+                        slots['legal_terms'] = st.empty()
+
+                        for key, slot in slots.items():
+                            if key in entry:
+                                slot.write(entry[key])
+                            else:
+                                slot.caption("Generating...")
 
                     with col2:
                         st.subheader("Document Q&A")
                         
                         # Document Q&A without page refresh using callbacks
                         st.text_input("Ask a question about this document", key="doc_question_input", on_change=submit_doc_question)
+                        st.toggle("Search relevant passages only", key="qa_retrieval", help="When off, the whole document is sent with every question")
                         
                         col1, col2 = st.columns([1, 3])
                         with col1:
@@ -543,6 +1021,9 @@ def main():
                                     st.markdown(f"<div class='user-message'><strong>You:</strong> {chat['content']}</div>", unsafe_allow_html=True)
                                 else:
                                     st.markdown(f"<div class='assistant-message'><strong>Assistant:</strong> {chat['content']}</div>", unsafe_allow_html=True)
+                            # Stream the answer to a question submitted since the last run
+                            if has_unanswered_question(st.session_state.doc_chat_history):
+                                write_assistant_reply(st.session_state.doc_chat_history, 'doc_question', lambda: doc_question_messages(st.session_state.doc_chat_history[-1]["content"]), current_document_tokens())
 
                         st.subheader("Feedback")
                         if not st.session_state.feedback_submitted:
@@ -555,6 +1036,9 @@ def main():
                             st.success("Thank you for your feedback!")
                             st.button("Provide More Feedback", on_click=reset_feedback)
 
+                    # The rest of the page is already shown; fill in each panel as its result lands
+                    finish_document_analysis(st.session_state.current_document_text, entry, pending, slots)
+
     elif menu == "My Documents":
         st.subheader("My Documents")
         
@@ -594,9 +1078,7 @@ def main():
         
         if term:
             with st.spinner("Retrieving definition..."):
-                api_result = fetch_definition_from_api(term)
-                augmented_result = augment_definition_with_llm(term, api_result, is_legal_specific)
-                generate_definition_output(term, augmented_result)
+                stream_definition_output(term, is_legal_specific)
                 
                 if term not in [item['term'] for item in st.session_state.dictionary_history]:
                     st.session_state.dictionary_history.append({
@@ -0,0 +1,135 @@
+import os
+import threading
+from collections import deque
+
+from token_budget import count_message_tokens, prompt_budget
+
+SMALL_MODEL = os.getenv('LEXIGUIDE_ROUTING_SMALL_MODEL', 'gpt-4o-mini')
+LARGE_MODEL = os.getenv('LEXIGUIDE_ROUTING_LARGE_MODEL', 'gpt-4o')
+# 'balanced' picks by document length, 'cost' always prefers the small model,
+# 'quality' always the large one, 'fixed' keeps the original per-task models
+POLICY = os.getenv('LEXIGUIDE_ROUTING_POLICY', 'balanced')
+# Under 'balanced', documents longer than this (tokens) go to the large model
+LARGE_DOCUMENT_TOKENS = int(os.getenv('LEXIGUIDE_ROUTING_LARGE_DOCUMENT_TOKENS', '4000'))
+# When set, a task whose large-model route averages slower than this (seconds) falls back to the small model
+MAX_LATENCY_S = float(os.getenv('LEXIGUIDE_ROUTING_MAX_LATENCY_S', '0'))
+
+# Tasks whose quality depends on the document; the others are short, generic requests.
+# A sidebar chat turn is about the loaded document when one is loaded.
+DOCUMENT_TASKS = ('analysis', 'legal_terms', 'doc_question', 'chat')
+
+# Models used before routing existed, for the 'fixed' policy
+FIXED_MODELS = {
+    'analysis': 'gpt-4o',
+    'chunk_summary': 'gpt-4o',
+    'legal_terms': 'gpt-4o',
+}
+FIXED_DEFAULT_MODEL = 'gpt-3.5-turbo'
+
+# USD per million (prompt, completion) tokens, for the cost estimate in the metrics
+MODEL_PRICES = {
+    'gpt-4o': (2.50, 10.00),
+    'gpt-4o-mini': (0.15, 0.60),
+    'gpt-3.5-turbo': (0.50, 1.50),
+}
+
+# Latency samples kept per route for the percentiles
+_LATENCY_WINDOW = 200
+# While a large route is over the latency budget, every this many calls still
+# go to it so its latency keeps being measured and it can recover
+_LATENCY_PROBE_EVERY = 10
+
+
+class ModelRouter:
+    """Picks the model for each LLM call and keeps latency and token metrics per route
+
+    A route is a task plus the tier it was sent to, e.g. 'analysis:small', so
+    the metrics show what each routing decision costs and how fast it is.
+    """
+
+    def __init__(self, policy=None, small_model=None, large_model=None,
+                 large_document_tokens=None, max_latency_s=None):
+        self.policy = policy or POLICY
+        self.small_model = small_model or SMALL_MODEL
+        self.large_model = large_model or LARGE_MODEL
+        self.large_document_tokens = large_document_tokens or LARGE_DOCUMENT_TOKENS
+        self.max_latency_s = MAX_LATENCY_S if max_latency_s is None else max_latency_s
+        self._lock = threading.Lock()
+        self._routes = {}
+        self._fallbacks = 0
+
+    def _tier(self, task, document_tokens):
+        if self.policy == 'quality':
+            return 'large'
+        if self.policy == 'cost' or task not in DOCUMENT_TASKS:
+            return 'small'
+        if document_tokens <= self.large_document_tokens:
+            return 'small'
+        if self.max_latency_s and self.average_latency(f"{task}:large") > self.max_latency_s:
+            with self._lock:
+                self._fallbacks += 1
+                probe = self._fallbacks % _LATENCY_PROBE_EVERY == 0
+            return 'large' if probe else 'small'
+        return 'large'
+
+    def choose(self, task, messages=None, document_tokens=None):
+        """Return (route, model) for a task
+
+        document_tokens is the size of the document the task is about; when not
+        given, the size of the messages is used. A prompt too long for the small
+        model's budget always goes to the large model.
+        """
+        if self.policy == 'fixed':
+            return f"{task}:fixed", FIXED_MODELS.get(task, FIXED_DEFAULT_MODEL)
+
+        prompt_tokens = count_message_tokens(messages, self.small_model) if messages else 0
+        if document_tokens is None:
+            document_tokens = prompt_tokens
+        tier = self._tier(task, document_tokens)
+        if tier == 'small' and prompt_tokens > prompt_budget(self.small_model) > 0 \
+                and prompt_budget(self.large_model) > prompt_budget(self.small_model):
+            tier = 'large'
+        return f"{task}:{tier}", self.small_model if tier == 'small' else self.large_model
+
+    def record(self, route, model, prompt_tokens, completion_tokens, latency, cached=False):
+        """Add one call to the route's metrics; cached (or shared) calls cost nothing"""
+        with self._lock:
+            stats = self._routes.setdefault(route, {
+                'model': model,
+                'calls': 0,
+                'cached_calls': 0,
+                'prompt_tokens': 0,
+                'completion_tokens': 0,
+                'cost_usd': 0.0,
+                'latencies': deque(maxlen=_LATENCY_WINDOW),
+            })
+            stats['model'] = model
+            stats['calls'] += 1
+            if cached:
+                stats['cached_calls'] += 1
+                return
+            stats['latencies'].append(latency)
+            stats['prompt_tokens'] += prompt_tokens
+            stats['completion_tokens'] += completion_tokens
+            prompt_price, completion_price = MODEL_PRICES.get(model, (0.0, 0.0))
+            stats['cost_usd'] += (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1e6
+
+    def average_latency(self, route):
+        """Mean latency of the route's recent uncached calls, 0.0 when there are none"""
+        with self._lock:
+            latencies = self._routes.get(route, {}).get('latencies')
+            return sum(latencies) / len(latencies) if latencies else 0.0
+
+    def summary(self):
+        """Per-route calls, tokens, estimated cost and latency percentiles, for the metrics panel"""
+        with self._lock:
+            summary = {}
+            for route, stats in sorted(self._routes.items()):
+                latencies = sorted(stats['latencies'])
+                summary[route] = {
+                    **{name: value for name, value in stats.items() if name != 'latencies'},
+                    'cost_usd': round(stats['cost_usd'], 4),
+                    'p50_latency_s': round(latencies[len(latencies) // 2], 3) if latencies else 0.0,
+                    'p95_latency_s': round(latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))], 3) if latencies else 0.0,
+                }
+            return summary
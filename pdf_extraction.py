@@ -0,0 +1,319 @@
+import io
+import mmap
+import os
+import tempfile
+from contextlib import contextmanager
+from concurrent.futures.process import BrokenProcessPool
+
+import PyPDF2
+from PIL import Image
+
+from image_ocr import image_to_text
+from worker_pool import get_pool, reset_pool
+
+try:
+    import fitz  # PyMuPDF, used to rasterize scanned pages for OCR
+except ImportError:
+    fitz = None
+
+# Files with fewer pages than this are extracted serially; pool overhead dominates below it
+MIN_PARALLEL_PAGES = int(os.getenv('LEXIGUIDE_PDF_MIN_PARALLEL_PAGES', '16'))
+DEFAULT_WORKERS = int(os.getenv('LEXIGUIDE_PDF_WORKERS', str(os.cpu_count() or 1)))
+OCR_ENABLED = os.getenv('LEXIGUIDE_PDF_OCR', '1') != '0'
+OCR_DPI = int(os.getenv('LEXIGUIDE_PDF_OCR_DPI', '300'))
+# Pages per pool task when streaming; small batches get the first page back sooner
+STREAM_BATCH_PAGES = int(os.getenv('LEXIGUIDE_PDF_STREAM_BATCH_PAGES', '4'))
+# Uploads larger than this are spooled to a temporary file and memory-mapped
+SPOOL_THRESHOLD = int(os.getenv('LEXIGUIDE_SPOOL_THRESHOLD_MB', '20')) * 1024 * 1024
+
+
+def _spool(data):
+    """Write data to a new temporary PDF file and return its path"""
+    handle, path = tempfile.mkstemp(suffix=".pdf", prefix="lexiguide-")
+    with os.fdopen(handle, "wb") as f:
+        f.write(data)
+    return path
+
+
+@contextmanager
+def pool_source(source):
+    """Yield a file path for source, spooling bytes to a temporary file if needed
+
+    Pool tasks are given the path and map the file, instead of each task
+    receiving a pickled copy of the whole PDF.
+    """
+    if isinstance(source, str):
+        yield source
+        return
+    path = _spool(source)
+    try:
+        yield path
+    finally:
+        os.remove(path)
+
+
+@contextmanager
+def spooled_source(upload):
+    """Yield a PDF source for the extraction functions
+
+    Small uploads are passed around as bytes. Large ones are written once to a
+    temporary file and its path is yielded instead, so pool workers map the file
+    rather than each receiving a pickled copy of the whole upload. The file is
+    removed on exit.
+    """
+    with upload.getbuffer() as view:
+        if len(view) <= SPOOL_THRESHOLD:
+            data = bytes(view)
+        else:
+            data = None
+            path = _spool(view)
+
+    if data is not None:
+        yield data
+        return
+    try:
+        yield path
+    finally:
+        os.remove(path)
+
+
+def _open_reader(source):
+    """Open a PdfReader on bytes, or on a memory map of a spooled file path"""
+    if isinstance(source, str):
+        with open(source, "rb") as f:
+            # The map stays valid after the file is closed and is released with the reader
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return PyPDF2.PdfReader(data)
+    return PyPDF2.PdfReader(io.BytesIO(source))
+
+
+def _open_fitz(source):
+    if isinstance(source, str):
+        return fitz.open(source)
+    return fitz.open(stream=source, filetype="pdf")
+
+
+def split_page_ranges(page_count, parts):
+    """Split page_count pages into at most `parts` contiguous (start, end) ranges"""
+    parts = max(1, min(parts, page_count))
+    size, extra = divmod(page_count, parts)
+    ranges = []
+    start = 0
+    for i in range(parts):
+        end = start + size + (1 if i < extra else 0)
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+
+def _extract_page_range(source, start, end):
+    """Worker: extract the text of pages [start, end) from the PDF source"""
+    reader = _open_reader(source)
+    return [reader.pages[i].extract_text() or "" for i in range(start, end)]
+
+
+def _ocr_fitz_page(doc, index, dpi):
+    """Rasterize one page of an open PyMuPDF document and OCR it"""
+    zoom = dpi / 72
+    pixmap = doc[index].get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY)
+    image = Image.frombytes("L", (pixmap.width, pixmap.height), pixmap.samples)
+    return image_to_text(image)
+
+
+def _ocr_page_batch(source, page_indices, dpi):
+    """Worker: rasterize the given pages and OCR them with Tesseract"""
+    doc = _open_fitz(source)
+    try:
+        return [_ocr_fitz_page(doc, index, dpi) for index in page_indices]
+    finally:
+        doc.close()
+
+
+def _extract_pages_with_ocr(source, start, end, ocr, dpi):
+    """Worker: extract pages [start, end), OCR-ing any page without a text layer"""
+    pages = _extract_page_range(source, start, end)
+    if ocr and fitz is not None:
+        empty = [start + i for i, text in enumerate(pages) if not text.strip()]
+        if empty:
+            for index, text in zip(empty, _ocr_page_batch(source, empty, dpi)):
+                pages[index - start] = text
+    return pages
+
+
+def _run_batches(pool, worker, source, batches, *args):
+    """Run worker over each batch in the pool, concatenating results in batch order"""
+    with pool_source(source) as path:
+        futures = [pool.submit(worker, path, *batch, *args) for batch in batches]
+        results = []
+        for future in futures:
+            results.extend(future.result())
+    return results
+
+
+def extract_pdf_pages(source, max_workers=None, min_parallel_pages=None):
+    """Extract the text of every page, in page order
+
+    source is the PDF bytes or the path of a spooled file. Large files are
+    split into page ranges and extracted across a process pool; small files,
+    or max_workers <= 1, use the serial path.
+    """
+    workers = max_workers if max_workers is not None else DEFAULT_WORKERS
+    threshold = min_parallel_pages if min_parallel_pages is not None else MIN_PARALLEL_PAGES
+
+    reader = _open_reader(source)
+    page_count = len(reader.pages)
+
+    if workers <= 1 or page_count < threshold:
+        return [page.extract_text() or "" for page in reader.pages]
+
+    pool = get_pool()
+    try:
+        return _run_batches(pool, _extract_page_range, source, split_page_ranges(page_count, workers))
+    except BrokenProcessPool:
+        # A worker died (e.g. OOM); drop the pool and fall back to the serial path
+        reset_pool(pool)
+        return [page.extract_text() or "" for page in reader.pages]
+
+
+def ocr_empty_pages(source, pages, max_workers=None, dpi=None):
+    """OCR only the pages that have no text layer, keeping native text elsewhere
+
+    Returns a new list of page texts in the same order. Without PyMuPDF the
+    pages are returned unchanged.
+    """
+    empty = [i for i, text in enumerate(pages) if not text.strip()]
+    if not empty or fitz is None:
+        return pages
+
+    workers = max_workers if max_workers is not None else DEFAULT_WORKERS
+    dpi = dpi or OCR_DPI
+
+    if workers <= 1 or len(empty) == 1:
+        ocr_texts = _ocr_page_batch(source, empty, dpi)
+    else:
+        batches = [(empty[start:end],) for start, end in split_page_ranges(len(empty), workers)]
+        pool = get_pool()
+        try:
+            ocr_texts = _run_batches(pool, _ocr_page_batch, source, batches, dpi)
+        except BrokenProcessPool:
+            reset_pool(pool)
+            ocr_texts = _ocr_page_batch(source, empty, dpi)
+
+    merged = list(pages)
+    for index, text in zip(empty, ocr_texts):
+        merged[index] = text
+    return merged
+
+
+def count_pdf_pages(source):
+    """Return the number of pages in the PDF"""
+    return len(_open_reader(source).pages)
+
+
+def _iter_pages_serial(source, first, ocr, dpi):
+    reader = _open_reader(source)
+    doc = None
+    try:
+        for index in range(first, len(reader.pages)):
+            text = reader.pages[index].extract_text() or ""
+            if ocr and fitz is not None and not text.strip():
+                # Opened on the first scanned page and reused for the rest
+                doc = doc or _open_fitz(source)
+                text = _ocr_fitz_page(doc, index, dpi)
+            yield index + 1, text
+    finally:
+        if doc is not None:
+            doc.close()
+
+
+def _iter_pages_ocr_in_pool(source, ocr, dpi, workers):
+    """Yield pages of a short PDF, extracting text here and OCR-ing scanned pages in the pool
+
+    Native text extraction of a few pages is cheap, but OCR is not, so the
+    scanned pages are spread across the pool in one contiguous batch per worker.
+    """
+    pages = _extract_page_range(source, 0, count_pdf_pages(source))
+    empty = [i for i, text in enumerate(pages) if not text.strip()] if ocr and fitz is not None else []
+    if not empty:
+        for index, text in enumerate(pages):
+            yield index + 1, text
+        return
+
+    next_index = 0
+    futures = []
+    pool = get_pool()
+    try:
+        futures = [
+            (empty[start:end], pool.submit(_ocr_page_batch, source, empty[start:end], dpi))
+            for start, end in split_page_ranges(len(empty), workers)
+        ]
+        ocr_texts = {}
+        pending = iter(futures)
+        for index, text in enumerate(pages):
+            while index in empty and index not in ocr_texts:
+                indices, future = next(pending)
+                ocr_texts.update(zip(indices, future.result()))
+            next_index = index + 1
+            yield next_index, ocr_texts.get(index, text)
+    except BrokenProcessPool:
+        reset_pool(pool)
+        yield from _iter_pages_serial(source, next_index, ocr, dpi)
+    finally:
+        for _, future in futures:
+            future.cancel()
+
+
+def iter_pdf_pages(source, max_workers=None, batch_pages=None, ocr=None, dpi=None):
+    """Yield (page_no, text) pairs in page order as soon as each page is ready
+
+    Page numbers start at 1. Scanned pages are OCR'd in the process pool when
+    ocr is enabled, whatever the page count. Large files are extracted in page
+    batches across the pool, so the first pages arrive long before the last;
+    pool tasks always read a spooled file rather than pickled PDF bytes.
+    """
+    workers = max_workers if max_workers is not None else DEFAULT_WORKERS
+    batch_pages = batch_pages or STREAM_BATCH_PAGES
+    ocr = OCR_ENABLED if ocr is None else ocr
+    dpi = dpi or OCR_DPI
+
+    if workers <= 1:
+        yield from _iter_pages_serial(source, 0, ocr, dpi)
+        return
+
+    with pool_source(source) as path:
+        page_count = count_pdf_pages(path)
+        if page_count < MIN_PARALLEL_PAGES:
+            yield from _iter_pages_ocr_in_pool(path, ocr, dpi, workers)
+            return
+
+        # Small first batches get the first pages back quickly; later ones grow so
+        # a long file is not re-parsed by hundreds of tiny tasks
+        ranges = []
+        start, size = 0, batch_pages
+        while start < page_count:
+            ranges.append((start, min(start + size, page_count)))
+            start += size
+            size = max(size, page_count // (workers * 4))
+
+        next_index = 0
+        futures = []
+        pool = get_pool()
+        try:
+            futures = [pool.submit(_extract_pages_with_ocr, path, start, end, ocr, dpi) for start, end in ranges]
+            for future in futures:
+                for text in future.result():
+                    next_index += 1
+                    yield next_index, text
+        except BrokenProcessPool:
+            # Continue serially from the first page that has not been yielded yet
+            reset_pool(pool)
+            yield from _iter_pages_serial(path, next_index, ocr, dpi)
+        finally:
+            # Stop queued work if the consumer abandons the generator early
+            for future in futures:
+                future.cancel()
+
+
+def join_pages(pages):
+    """Join page texts with a single join, separating pages by a blank line"""
+    return "".join(f"{page}\n\n" for page in pages)
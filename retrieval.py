@@ -0,0 +1,146 @@
+import heapq
+import math
+import os
+import re
+from array import array
+from collections import Counter
+
+from text_chunking import estimate_tokens, split_into_chunks
+
+# Size of the passages a document is split into for retrieval
+CHUNK_TOKENS = int(os.getenv('LEXIGUIDE_RETRIEVAL_CHUNK_TOKENS', '400'))
+# Number of passages sent with each question
+TOP_K = int(os.getenv('LEXIGUIDE_RETRIEVAL_TOP_K', '4'))
+
+# BM25 parameters
+K1 = 1.5
+B = 0.75
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    """Lowercase alphanumeric terms of text"""
+    return _TOKEN.findall(text.lower())
+
+
+def _idf(chunk_count, doc_freq):
+    return math.log(1 + (chunk_count - doc_freq + 0.5) / (doc_freq + 0.5))
+
+
+class DocumentIndex:
+    """Passages of one document with a BM25 inverted index over them
+
+    Each term's postings are two parallel unsigned int arrays (chunk ids and
+    term frequencies), so the index stays compact for long documents. Text can
+    be added incrementally, e.g. page by page while a PDF is being extracted.
+    """
+
+    def __init__(self, text=None, chunk_tokens=None):
+        self.chunk_tokens = chunk_tokens or CHUNK_TOKENS
+        self.chunks = []
+        self.lengths = array('I')
+        self.total_length = 0
+        self.postings = {}
+        if text:
+            self.add_text(text)
+
+    def add_text(self, text):
+        """Chunk text and index its passages after the existing ones"""
+        for chunk in split_into_chunks(text, self.chunk_tokens):
+            self.add_chunk(chunk)
+
+    def add_chunk(self, chunk):
+        """Index a single passage"""
+        chunk_id = len(self.chunks)
+        counts = Counter(tokenize(chunk))
+        self.chunks.append(chunk)
+        length = sum(counts.values())
+        self.lengths.append(length)
+        self.total_length += length
+        for term, tf in counts.items():
+            postings = self.postings.get(term)
+            if postings is None:
+                postings = self.postings[term] = (array('I'), array('I'))
+            postings[0].append(chunk_id)
+            postings[1].append(tf)
+
+    def search(self, query, k=None):
+        """Return up to k (chunk_index, score) pairs, best first
+
+        Only the postings of the query terms are visited.
+        """
+        k = k or TOP_K
+        chunk_count = len(self.chunks)
+        if not chunk_count:
+            return []
+        avg_length = self.total_length / chunk_count or 1
+        lengths = self.lengths
+
+        scores = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if postings is None:
+                continue
+            chunk_ids, tfs = postings
+            idf = _idf(chunk_count, len(chunk_ids))
+            for chunk_id, tf in zip(chunk_ids, tfs):
+                norm = K1 * (1 - B + B * lengths[chunk_id] / avg_length)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (K1 + 1) / (tf + norm)
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+    def top_passages(self, query, k=None):
+        """Return the text of the best matching passages, in document order"""
+        indexes = sorted(index for index, _ in self.search(query, k))
+        return [self.chunks[index] for index in indexes]
+
+
+def scan_search(chunks, query, k=None):
+    """BM25 by tokenizing and scoring every chunk per query, without an index
+
+    Kept as the baseline the inverted index is benchmarked against.
+    """
+    k = k or TOP_K
+    term_counts = [Counter(tokenize(chunk)) for chunk in chunks]
+    if not term_counts:
+        return []
+    lengths = [sum(counts.values()) for counts in term_counts]
+    avg_length = sum(lengths) / len(lengths) or 1
+    terms = set(tokenize(query))
+    doc_freq = {term: sum(1 for counts in term_counts if term in counts) for term in terms}
+
+    scores = []
+    for index, counts in enumerate(term_counts):
+        norm = K1 * (1 - B + B * lengths[index] / avg_length)
+        score = 0.0
+        for term in terms:
+            tf = counts.get(term, 0)
+            if tf:
+                score += _idf(len(chunks), doc_freq[term]) * tf * (K1 + 1) / (tf + norm)
+        if score > 0:
+            scores.append((index, score))
+    scores.sort(key=lambda item: item[1], reverse=True)
+    return scores[:k]
+
+
+def fuse_rankings(rankings, k, offset=60):
+    """Merge ranked lists of chunk ids with reciprocal rank fusion, returning the top k ids
+
+    Every ranking must number the same passages, e.g. a DocumentIndex and a
+    vector index built from its chunks.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (offset + rank + 1)
+    return heapq.nlargest(k, scores, key=scores.get)
+
+
+def fits_in_context(text, k=None, chunk_tokens=None):
+    """Whether the whole document is no larger than the passages retrieval would send"""
+    return estimate_tokens(text) <= (k or TOP_K) * (chunk_tokens or CHUNK_TOKENS)
+
+
+def format_passages(passages):
+    """Render passages as numbered excerpts for a prompt"""
+    return "\n\n".join(f"[Excerpt {i + 1}]\n{passage}" for i, passage in enumerate(passages))
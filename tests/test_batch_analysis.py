@@ -0,0 +1,165 @@
+"""Tests for the batch pipeline's rounds, retries and results, against a fake Batch API"""
+import json
+import os
+import sys
+import types
+
+import pytest
+
+for module in ("dotenv", "openai", "PIL", "numpy", "pytesseract", "PyPDF2"):
+    pytest.importorskip(module)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import batch_analysis  # noqa: E402
+import document_store  # noqa: E402
+from batch_analysis import MAX_ATTEMPTS, load_manifest, pending_requests, poll, prepare  # noqa: E402
+
+
+class FakeBatchClient:
+    """Minimal files and batches endpoints; every batch finishes as soon as it is polled
+
+    reply(custom_id, body) returns the reply text, or None for a failed request.
+    With status='failed' batches fail outright, without output or error files.
+    """
+
+    def __init__(self, reply, status="completed"):
+        self.reply = reply
+        self.status = status
+        self.contents = {}
+        self.inputs = {}
+        # custom_ids of each batch, in submission order
+        self.submitted = []
+        self.files = types.SimpleNamespace(create=self._create_file, content=self._content)
+        self.batches = types.SimpleNamespace(create=self._create_batch, retrieve=self._retrieve)
+
+    def _store(self, text):
+        file_id = f"file-{len(self.contents)}"
+        self.contents[file_id] = text
+        return file_id
+
+    def _create_file(self, file, purpose):
+        return types.SimpleNamespace(id=self._store(file.read().decode("utf-8")))
+
+    def _content(self, file_id):
+        return types.SimpleNamespace(text=self.contents[file_id])
+
+    def _create_batch(self, input_file_id, **kwargs):
+        batch_id = f"batch-{len(self.inputs)}"
+        self.inputs[batch_id] = input_file_id
+        return types.SimpleNamespace(id=batch_id)
+
+    def _retrieve(self, batch_id):
+        input_file_id = self.inputs[batch_id]
+        requests = [json.loads(line) for line in self.contents[input_file_id].splitlines()]
+        self.submitted.append([request["custom_id"] for request in requests])
+        if self.status != "completed":
+            return types.SimpleNamespace(status=self.status, input_file_id=input_file_id,
+                                         output_file_id=None, error_file_id=None)
+        output, errors = [], []
+        for request in requests:
+            reply = self.reply(request["custom_id"], request["body"])
+            if reply is None:
+                errors.append({"custom_id": request["custom_id"], "response": {"status_code": 500, "body": {}}})
+            else:
+                output.append({"custom_id": request["custom_id"], "response": {
+                    "status_code": 200, "body": {"choices": [{"message": {"content": reply}}]}}})
+        return types.SimpleNamespace(
+            status="completed",
+            input_file_id=input_file_id,
+            output_file_id=self._store("\n".join(json.dumps(line) for line in output)) if output else None,
+            error_file_id=self._store("\n".join(json.dumps(line) for line in errors)) if errors else None,
+        )
+
+
+@pytest.fixture(autouse=True)
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(document_store, "DOCUMENT_DIR", str(tmp_path / "documents"))
+    monkeypatch.setattr(document_store, "ANALYSIS_HISTORY_PATH", str(tmp_path / "history.json"))
+    return tmp_path
+
+
+def write_documents(directory, documents):
+    directory.mkdir()
+    for name, text in documents.items():
+        (directory / name).write_text(text, encoding="utf-8")
+    return str(directory)
+
+
+def echo_reply(custom_id, body):
+    return f"reply to {custom_id}"
+
+
+def run_job(tmp_path, client, documents):
+    work_dir = str(tmp_path / "work")
+    prepare(write_documents(tmp_path / "docs", documents), work_dir)
+    poll(client, work_dir, wait=True)
+    return load_manifest(work_dir)
+
+
+def test_short_documents_are_analyzed_in_one_round(tmp_path):
+    client = FakeBatchClient(echo_reply)
+    manifest = run_job(tmp_path, client, {"lease.txt": "The tenant pays rent.", "nda.md": "Keep it secret."})
+
+    assert manifest['round'] == 1
+    assert manifest['stored'] and manifest['failures'] == {}
+    history = {entry['document_name']: entry for entry in document_store.load_analysis_history()}
+    assert history['lease']['analysis'] == "reply to doc0/analysis"
+    assert history['nda']['legal_terms'] == "reply to doc1/terms"
+    # History entries point at the stored text so the documents can be reopened
+    assert document_store.load_text(history['lease']['text_id']) == "The tenant pays rent."
+
+
+def test_long_documents_are_summarized_then_merged(tmp_path, monkeypatch):
+    monkeypatch.setattr(batch_analysis, "CHUNK_TOKENS", 20)
+    text = "\n\n".join(f"Clause {i}: the parties agree to obligation number {i} in full." for i in range(6))
+    reduce_bodies = []
+
+    def reply(custom_id, body):
+        if custom_id.endswith("/analysis"):
+            reduce_bodies.append(body["messages"][-1]["content"])
+        return f"reply to {custom_id}"
+
+    client = FakeBatchClient(reply)
+    manifest = run_job(tmp_path, client, {"contract.txt": text})
+
+    parts = [custom_id for custom_id in client.submitted[0] if "/part/" in custom_id]
+    assert len(parts) > 1
+    assert "doc0/analysis" not in client.submitted[0]
+    assert client.submitted[1] == ["doc0/analysis"]
+    assert manifest['round'] == 2
+    # The merge request is built from every part's summary
+    assert all(f"reply to {part}" in reduce_bodies[0] for part in parts)
+
+
+def test_failed_requests_are_retried_then_given_up(tmp_path):
+    client = FakeBatchClient(lambda custom_id, body: None if custom_id == "doc0/terms" else "ok")
+    manifest = run_job(tmp_path, client, {"lease.txt": "The tenant pays rent."})
+
+    assert manifest['failures'] == {"doc0/terms": MAX_ATTEMPTS}
+    assert manifest['round'] == MAX_ATTEMPTS
+    assert pending_requests(manifest) == []
+    # The analysis is still stored, without a glossary
+    [entry] = document_store.load_analysis_history()
+    assert entry['analysis'] == "ok" and entry['legal_terms'] == ""
+
+
+def test_failed_batch_counts_an_attempt_for_every_request(tmp_path):
+    client = FakeBatchClient(echo_reply, status="failed")
+    manifest = run_job(tmp_path, client, {"lease.txt": "The tenant pays rent."})
+
+    assert manifest['failures'] == {"doc0/terms": MAX_ATTEMPTS, "doc0/analysis": MAX_ATTEMPTS}
+    assert manifest['round'] == MAX_ATTEMPTS
+    assert document_store.load_analysis_history() == []
+
+
+def test_prepare_skips_unreadable_and_unsupported_files(tmp_path):
+    source = write_documents(tmp_path / "docs", {
+        "broken.pdf": "not a pdf",
+        "notes.docx": "unsupported",
+        "empty.txt": "   ",
+        "lease.txt": "The tenant pays rent.",
+    })
+    manifest = prepare(source, str(tmp_path / "work"))
+
+    assert [document['name'] for document in manifest['documents'].values()] == ["lease"]
@@ -0,0 +1,77 @@
+"""Tests for splitting large images into OCR bands and stitching their texts back"""
+import os
+import sys
+
+import pytest
+
+np = pytest.importorskip("numpy")
+Image = pytest.importorskip("PIL.Image")
+pytest.importorskip("pytesseract")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from image_ocr import count_text_lines, split_bands, stitch_band_texts  # noqa: E402
+
+LINE_ROWS = 30
+GAP_ROWS = 20
+
+
+def page_image(lines, width=200):
+    """White page with a black bar for each text line, LINE_ROWS tall and GAP_ROWS apart"""
+    pixels = np.full((lines * (LINE_ROWS + GAP_ROWS) + GAP_ROWS, width), 255, dtype=np.uint8)
+    for i in range(lines):
+        top = GAP_ROWS + i * (LINE_ROWS + GAP_ROWS)
+        pixels[top:top + LINE_ROWS, 10:width - 10] = 0
+    return Image.fromarray(pixels, mode="L")
+
+
+def is_blank_row(image, row):
+    return np.asarray(image)[row].min() == 255
+
+
+def test_bands_cover_the_image_and_overlap():
+    image = page_image(40)
+    ranges = split_bands(image, 4, 40)
+    assert len(ranges) == 4
+    assert ranges[0][0] == 0 and ranges[-1][1] == image.height
+    for (_, bottom), (top, _) in zip(ranges, ranges[1:]):
+        assert top < bottom
+
+
+def test_band_edges_fall_on_blank_rows():
+    image = page_image(40)
+    for top, bottom in split_bands(image, 4, 40):
+        assert is_blank_row(image, top)
+        assert is_blank_row(image, bottom - 1)
+
+
+def test_small_image_is_a_single_band():
+    image = page_image(2)
+    assert split_bands(image, 8, 80) == [(0, image.height)]
+
+
+def test_count_text_lines_counts_inked_runs():
+    image = page_image(5)
+    ink = 255.0 - np.asarray(image, dtype=np.float32).mean(axis=1)
+    assert count_text_lines(ink) == 5
+    assert count_text_lines(ink[:0]) == 0
+
+
+def test_overlapping_lines_are_emitted_once():
+    texts = ["one\ntwo\nthree", "two\nthree\nfour"]
+    assert stitch_band_texts(texts, [2]) == "one\ntwo\nthree\nfour"
+
+
+def test_near_identical_overlap_lines_are_matched():
+    texts = ["Section 1\nThe Tenant shall pay", "The Tenant shal1 pay\nrent monthly"]
+    assert stitch_band_texts(texts) == "Section 1\nThe Tenant shall pay\nrent monthly"
+
+
+def test_lines_repeated_at_a_band_edge_are_kept_when_not_in_the_overlap():
+    texts = ["Terms\nSignature: ________", "Signature: ________\nDate"]
+    assert stitch_band_texts(texts, [0]) == "Terms\nSignature: ________\nSignature: ________\nDate"
+
+
+def test_no_more_lines_are_dropped_than_the_bands_share():
+    texts = ["a\nsigned\nsigned", "signed\nsigned\nb"]
+    assert stitch_band_texts(texts, [1]) == "a\nsigned\nsigned\nsigned\nb"
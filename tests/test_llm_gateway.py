@@ -0,0 +1,287 @@
+"""Tests for the LLM gateway's retries and limits, and for request coalescing
+
+The OpenAI client is replaced by a fake, so no network or API key is needed.
+"""
+import os
+import sys
+import threading
+import time
+import types
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import openai  # noqa: F401
+except ImportError:
+    # The gateway only needs the openai error classes at import time
+    openai = types.ModuleType("openai")
+    for name in ("RateLimitError", "APITimeoutError", "APIConnectionError", "InternalServerError"):
+        setattr(openai, name, type(name, (Exception,), {}))
+    sys.modules["openai"] = openai
+
+import llm_gateway  # noqa: E402
+from llm_gateway import DeadlineExceeded, LLMGateway, SingleFlight, deadline_after  # noqa: E402
+
+MODEL = "test-model"
+
+
+class RetryableError(Exception):
+    """Stands in for a throttling or 5xx error, with an optional Retry-After header"""
+
+    def __init__(self, retry_after=None):
+        super().__init__("retryable")
+        headers = {'retry-after': retry_after} if retry_after is not None else {}
+        self.response = types.SimpleNamespace(headers=headers)
+
+
+class Abort(BaseException):
+    """Stands in for KeyboardInterrupt or GeneratorExit reaching the gateway"""
+
+
+def fake_client(*outcomes):
+    """Client whose chat.completions.create returns or raises each outcome in turn"""
+    outcomes = list(outcomes)
+    calls = []
+
+    def create(**kwargs):
+        calls.append(kwargs)
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+    client = types.SimpleNamespace(chat=types.SimpleNamespace(completions=types.SimpleNamespace(create=create)))
+    return client, calls
+
+
+@pytest.fixture(autouse=True)
+def retryable(monkeypatch):
+    monkeypatch.setattr(llm_gateway, 'RETRYABLE_ERRORS', (RetryableError,))
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Record backoff sleeps instead of sleeping"""
+    recorded = []
+    monkeypatch.setattr(llm_gateway.time, 'sleep', recorded.append)
+    return recorded
+
+
+def make_gateway(client, **kwargs):
+    kwargs.setdefault('max_concurrency', 1)
+    kwargs.setdefault('requests_per_minute', 60000)
+    kwargs.setdefault('base_delay', 0.01)
+    return LLMGateway(client, **kwargs)
+
+
+def assert_slots_free(gateway, model=MODEL):
+    semaphore, _, stats = gateway._limits(model)
+    assert stats['in_flight'] == 0
+    assert semaphore.acquire(blocking=False), "a concurrency slot was not released"
+    semaphore.release()
+
+
+def test_backoff_honours_retry_after(sleeps):
+    client, calls = fake_client(RetryableError(retry_after="2"), "reply")
+    gateway = make_gateway(client)
+
+    assert gateway.chat(MODEL, [], deadline_after(60)) == "reply"
+    assert len(calls) == 2
+    assert sleeps == [2.0]
+    assert gateway.stats()[MODEL]['retries'] == 1
+
+
+def test_backoff_ignores_malformed_retry_after(sleeps):
+    client, _ = fake_client(RetryableError(retry_after="soon"), "reply")
+    gateway = make_gateway(client)
+
+    assert gateway.chat(MODEL, [], deadline_after(60)) == "reply"
+    assert len(sleeps) == 1 and sleeps[0] <= 0.01
+
+
+def test_retry_after_beyond_deadline_raises(sleeps):
+    client, calls = fake_client(RetryableError(retry_after="30"), "reply")
+    gateway = make_gateway(client)
+
+    with pytest.raises(DeadlineExceeded):
+        gateway.chat(MODEL, [], deadline_after(5))
+    assert len(calls) == 1
+    assert sleeps == []
+    assert gateway.stats()[MODEL]['deadline_exceeded'] == 1
+    assert_slots_free(gateway)
+
+
+@pytest.mark.parametrize("outcomes, error", [
+    ([RetryableError(), RetryableError()], RetryableError),
+    ([ValueError("bad request")], ValueError),
+    ([Abort()], Abort),
+])
+def test_slot_released_when_call_fails(sleeps, outcomes, error):
+    client, _ = fake_client(*outcomes)
+    gateway = make_gateway(client, max_retries=1)
+
+    with pytest.raises(error):
+        gateway.chat(MODEL, [], deadline_after(60))
+    assert_slots_free(gateway)
+
+
+def test_slot_released_after_each_retry(sleeps):
+    client, calls = fake_client(RetryableError(), RetryableError(), "reply")
+    gateway = make_gateway(client)
+
+    # With one slot, a retry could only proceed if the failed attempt gave it back
+    assert gateway.chat(MODEL, [], deadline_after(60)) == "reply"
+    assert len(calls) == 3
+    assert_slots_free(gateway)
+
+
+def test_slot_held_while_streaming_and_released_when_done():
+    client, _ = fake_client(iter(["a", "b"]))
+    gateway = make_gateway(client)
+
+    stream = gateway.stream_chat(MODEL, [], deadline_after(60))
+    assert next(stream) == "a"
+    assert gateway.stats()[MODEL]['in_flight'] == 1
+    assert list(stream) == ["b"]
+    assert_slots_free(gateway)
+
+
+def test_slot_released_when_stream_is_closed_early():
+    client, _ = fake_client(iter(["a", "b"]))
+    gateway = make_gateway(client)
+
+    stream = gateway.stream_chat(MODEL, [], deadline_after(60))
+    next(stream)
+    stream.close()
+    assert_slots_free(gateway)
+
+
+def test_slot_released_when_stream_fails_midway():
+    def chunks():
+        yield "a"
+        raise RetryableError()
+
+    client, _ = fake_client(chunks())
+    gateway = make_gateway(client)
+
+    stream = gateway.stream_chat(MODEL, [], deadline_after(60))
+    assert next(stream) == "a"
+    # Once chunks were used the error is not retried
+    with pytest.raises(RetryableError):
+        next(stream)
+    assert_slots_free(gateway)
+
+
+def test_waiting_for_a_slot_is_bounded_by_the_deadline():
+    client, _ = fake_client(iter(["a"]))
+    gateway = make_gateway(client)
+
+    stream = gateway.stream_chat(MODEL, [], deadline_after(60))
+    next(stream)
+    with pytest.raises(DeadlineExceeded):
+        gateway.chat(MODEL, [], deadline_after(0.05))
+    stream.close()
+    assert_slots_free(gateway)
+
+
+def start_leader(flights, key, outcome):
+    """Run a leader in a thread whose request blocks until released
+
+    Returns (release, results), where results receives the leader's return
+    value or exception.
+    """
+    started, release = threading.Event(), threading.Event()
+    results = []
+
+    def request():
+        started.set()
+        release.wait(5)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+    def run():
+        try:
+            results.append(flights.do(key, request))
+        except BaseException as error:
+            results.append(error)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    assert started.wait(5)
+    return release, results, thread
+
+
+def join_waiter(flights, key, request, deadline=None):
+    """Start a caller for key in a thread once the leader is in flight; returns (results, thread)"""
+    results = []
+    shared_before = flights.stats()['shared']
+
+    def run():
+        try:
+            results.append(flights.do(key, request, deadline))
+        except BaseException as error:
+            results.append(error)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    # Wait until the caller has joined the leader's flight
+    end = time.monotonic() + 5
+    while flights.stats()['shared'] == shared_before and time.monotonic() < end:
+        time.sleep(0.001)
+    return results, thread
+
+
+def test_waiters_share_the_leaders_result():
+    flights = SingleFlight()
+    release, leader_results, leader = start_leader(flights, "k", "reply")
+    waiter_results, waiter = join_waiter(flights, "k", lambda: pytest.fail("waiter must not call"))
+
+    release.set()
+    leader.join(5)
+    waiter.join(5)
+    assert leader_results == [("reply", False)]
+    assert waiter_results == [("reply", True)]
+    assert flights.stats() == {'leaders': 1, 'shared': 1, 'in_flight': 0}
+
+
+def test_waiters_get_the_leaders_error():
+    flights = SingleFlight()
+    error = ValueError("upstream failed")
+    release, leader_results, leader = start_leader(flights, "k", error)
+    waiter_results, waiter = join_waiter(flights, "k", lambda: pytest.fail("waiter must not call"))
+
+    release.set()
+    leader.join(5)
+    waiter.join(5)
+    assert leader_results == [error]
+    assert waiter_results == [error]
+    # The failed flight is forgotten, so the next caller starts a fresh request
+    assert flights.do("k", lambda: "retried") == ("retried", False)
+
+
+def test_waiters_retry_when_the_leader_is_abandoned():
+    flights = SingleFlight()
+    release, leader_results, leader = start_leader(flights, "k", Abort())
+    waiter_results, waiter = join_waiter(flights, "k", lambda: "second")
+
+    release.set()
+    leader.join(5)
+    waiter.join(5)
+    assert isinstance(leader_results[0], Abort)
+    # The waiter became the new leader rather than failing
+    assert waiter_results == [("second", False)]
+    assert flights.stats()['leaders'] == 2
+
+
+def test_waiter_gives_up_at_its_deadline():
+    flights = SingleFlight()
+    release, _, leader = start_leader(flights, "k", "reply")
+    waiter_results, waiter = join_waiter(flights, "k", lambda: "unused", deadline_after(0.05))
+
+    waiter.join(5)
+    assert isinstance(waiter_results[0], DeadlineExceeded)
+    release.set()
+    leader.join(5)
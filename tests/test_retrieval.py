@@ -0,0 +1,72 @@
+"""Tests for BM25 passage ranking and rank fusion"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from retrieval import DocumentIndex, fuse_rankings, scan_search  # noqa: E402
+
+PASSAGES = [
+    "The tenant shall pay rent on the first day of each month.",
+    "Either party may terminate this agreement with thirty days written notice.",
+    "The landlord is responsible for structural repairs and the roof.",
+    "Termination for cause requires notice and an opportunity to cure the breach.",
+    "The security deposit is returned within fourteen days after the tenant leaves.",
+]
+
+
+def build_index():
+    index = DocumentIndex(chunk_tokens=50)
+    for passage in PASSAGES:
+        index.add_chunk(passage)
+    return index
+
+
+def test_passage_with_the_query_terms_ranks_first():
+    index = build_index()
+    assert index.search("security deposit", 1)[0][0] == 4
+    assert index.search("roof repairs", 1)[0][0] == 2
+
+
+def test_rare_terms_outweigh_common_ones():
+    index = build_index()
+    # "tenant" appears in two passages, "cure" in one
+    best, _ = index.search("tenant cure", 1)[0]
+    assert best == 3
+
+
+def test_inverted_index_matches_the_scan_baseline():
+    index = build_index()
+    for query in ("terminate notice", "tenant rent month", "breach cure notice", "days"):
+        indexed = index.search(query, 3)
+        scanned = scan_search(PASSAGES, query, 3)
+        assert [i for i, _ in indexed] == [i for i, _ in scanned]
+        for (_, a), (_, b) in zip(indexed, scanned):
+            assert abs(a - b) < 1e-9
+
+
+def test_unknown_terms_and_empty_index_return_nothing():
+    assert build_index().search("indemnification", 3) == []
+    assert DocumentIndex().search("rent", 3) == []
+
+
+def test_text_added_incrementally_is_indexed_like_the_whole_text():
+    pages = ["\n\n".join(PASSAGES[:2]), "\n\n".join(PASSAGES[2:])]
+    incremental = DocumentIndex(chunk_tokens=20)
+    for page in pages:
+        incremental.add_text(page)
+    whole = DocumentIndex("\n\n".join(pages), chunk_tokens=20)
+    assert incremental.chunks == whole.chunks
+    assert incremental.search("deposit tenant", 2) == whole.search("deposit tenant", 2)
+
+
+def test_top_passages_are_in_document_order():
+    index = build_index()
+    assert index.top_passages("notice termination", 2) == [PASSAGES[1], PASSAGES[3]]
+
+
+def test_fuse_rankings_prefers_ids_ranked_well_by_both():
+    keyword = [3, 1, 0]
+    semantic = [1, 4, 3]
+    assert fuse_rankings([keyword, semantic], 2) == [1, 3]
+    assert fuse_rankings([[2]], 3) == [2]
@@ -0,0 +1,38 @@
+"""Tests for trimming prompts to a model's token budget"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from token_budget import count_message_tokens, fit_messages  # noqa: E402
+
+MODEL = "gpt-3.5-turbo"
+
+
+def test_messages_within_budget_are_unchanged():
+    messages = [{"role": "user", "content": "short question"}]
+    assert fit_messages(messages, MODEL, budget=1000) == messages
+
+
+def test_longest_message_is_cut_first():
+    messages = [
+        {"role": "system", "content": "You are a legal assistant."},
+        {"role": "user", "content": "clause " * 5000},
+    ]
+    fitted = fit_messages(messages, MODEL, budget=1000)
+    assert count_message_tokens(fitted, MODEL) <= 1000
+    assert fitted[0] == messages[0]
+    assert fitted[1]["content"].startswith("clause clause")
+
+
+def test_budget_holds_when_the_excess_exceeds_the_longest_message():
+    messages = [{"role": "system", "content": "x" * 40000}] + [{"role": "user", "content": "y" * 3000}] * 20
+    fitted = fit_messages(messages, MODEL, budget=12289)
+    assert count_message_tokens(fitted, MODEL) <= 12289
+
+
+def test_unfittable_prompt_raises():
+    with pytest.raises(ValueError):
+        fit_messages([{"role": "user", "content": "a"}] * 10, MODEL, budget=20)
@@ -0,0 +1,65 @@
+import re
+
+from token_budget import CHARS_PER_TOKEN, count_tokens
+
+# Lines that start a new section: "ARTICLE IV", "Section 2.", "12. Termination", "SCHEDULE A"
+_HEADING = re.compile(r'^\s*(article|section|schedule|exhibit|appendix|\d+(\.\d+)*[.)])\s', re.IGNORECASE)
+
+
+def estimate_tokens(text):
+    """Token count used to size chunks (exact when tiktoken is installed)"""
+    return count_tokens(text)
+
+
+def _split_oversized(paragraph, max_tokens):
+    """Split a paragraph that exceeds the budget on line boundaries, then by characters"""
+    pieces = []
+    current = ""
+    for line in paragraph.splitlines(keepends=True):
+        while estimate_tokens(line) > max_tokens:
+            cut = max_tokens * CHARS_PER_TOKEN
+            if current:
+                pieces.append(current)
+                current = ""
+            pieces.append(line[:cut])
+            line = line[cut:]
+        if current and estimate_tokens(current + line) > max_tokens:
+            pieces.append(current)
+            current = ""
+        current += line
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def split_into_chunks(text, max_tokens):
+    """Split text into chunks of at most max_tokens (estimated), in document order
+
+    Chunks break on paragraph and page boundaries, and a new chunk is started at
+    a section heading once the current one is at least half full, so sections
+    tend to stay together.
+    """
+    paragraphs = []
+    for paragraph in re.split(r'\n\s*\n', text):
+        if not paragraph.strip():
+            continue
+        if estimate_tokens(paragraph) > max_tokens:
+            paragraphs.extend(_split_oversized(paragraph, max_tokens))
+        else:
+            paragraphs.append(paragraph)
+
+    chunks = []
+    current = []
+    current_tokens = 0
+    for paragraph in paragraphs:
+        tokens = estimate_tokens(paragraph)
+        starts_section = bool(_HEADING.match(paragraph)) and current_tokens >= max_tokens // 2
+        if current and (current_tokens + tokens > max_tokens or starts_section):
+            chunks.append("\n\n".join(current))
+            current = []
+            current_tokens = 0
+        current.append(paragraph)
+        current_tokens += tokens
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
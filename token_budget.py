@@ -0,0 +1,156 @@
+import os
+import threading
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Rough characters-per-token ratio used when tiktoken is not installed
+CHARS_PER_TOKEN = 4
+
+# Context window of each model, in tokens
+MODEL_CONTEXT_TOKENS = {
+    'gpt-4o': 128000,
+    'gpt-4o-mini': 128000,
+    'gpt-3.5-turbo': 16385,
+}
+DEFAULT_CONTEXT_TOKENS = 16385
+# Tokens kept free in the context window for the reply
+COMPLETION_RESERVE = int(os.getenv('LEXIGUIDE_COMPLETION_RESERVE_TOKENS', '4096'))
+
+# Per-message framing overhead of the chat format
+_TOKENS_PER_MESSAGE = 4
+_TOKENS_PER_REPLY = 3
+_TRUNCATION_NOTE = "\n\n[... truncated to fit the model's context ...]"
+
+
+def parse_model_limits(value, convert=float):
+    """Parse per-model overrides written as 'model=n,model=n' into a dict"""
+    limits = {}
+    for item in (value or "").split(","):
+        if "=" in item:
+            model, limit = item.split("=", 1)
+            limits[model.strip()] = convert(limit)
+    return limits
+
+
+# Prompt budgets overriding context window minus reserve, e.g. "gpt-4o=60000,gpt-3.5-turbo=12000"
+PROMPT_BUDGETS = parse_model_limits(os.getenv('LEXIGUIDE_PROMPT_BUDGETS'), int)
+
+_encodings = {}
+
+
+def _encoding(model):
+    if model not in _encodings:
+        try:
+            _encodings[model] = tiktoken.encoding_for_model(model)
+        except KeyError:
+            _encodings[model] = tiktoken.get_encoding("o200k_base")
+    return _encodings[model]
+
+
+def count_tokens(text, model='gpt-4o'):
+    """Number of tokens in text for model (estimated when tiktoken is unavailable)"""
+    if tiktoken is None:
+        return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+    return len(_encoding(model).encode(text, disallowed_special=()))
+
+
+def message_tokens(message, model):
+    """Number of prompt tokens one chat message costs, including its framing"""
+    return _TOKENS_PER_MESSAGE + count_tokens(message["content"], model)
+
+
+def count_message_tokens(messages, model):
+    """Number of prompt tokens a list of chat messages costs"""
+    return _TOKENS_PER_REPLY + sum(message_tokens(message, model) for message in messages)
+
+
+def prompt_budget(model):
+    """Maximum prompt tokens allowed for model"""
+    if model in PROMPT_BUDGETS:
+        return PROMPT_BUDGETS[model]
+    return MODEL_CONTEXT_TOKENS.get(model, DEFAULT_CONTEXT_TOKENS) - COMPLETION_RESERVE
+
+
+def _truncate(text, max_tokens, model):
+    """Keep the beginning of text within max_tokens"""
+    if tiktoken is None:
+        return text[:max(0, max_tokens) * CHARS_PER_TOKEN]
+    encoding = _encoding(model)
+    return encoding.decode(encoding.encode(text, disallowed_special=())[:max(0, max_tokens)])
+
+
+def fit_messages(messages, model, budget=None):
+    """Return messages trimmed to the model's prompt budget
+
+    The longest message (normally the one carrying the document) is cut from
+    the end until the prompt fits. If cutting it entirely is not enough, the
+    next longest is cut too, and so on. Messages within budget are returned
+    as is. Raises ValueError if the prompt cannot fit even with every message
+    cut, e.g. because of the framing of a very long conversation.
+    """
+    budget = budget or prompt_budget(model)
+    trimmed = list(messages)
+    note_tokens = count_tokens(_TRUNCATION_NOTE, model)
+    while True:
+        excess = count_message_tokens(trimmed, model) - budget
+        if excess <= 0:
+            return trimmed
+        # Text of each message that can still be cut, without a truncation note already added
+        texts = [
+            message["content"][:-len(_TRUNCATION_NOTE)] if message["content"].endswith(_TRUNCATION_NOTE) else message["content"]
+            for message in trimmed
+        ]
+        candidates = [i for i, text in enumerate(texts) if text]
+        if not candidates:
+            raise ValueError(f"Prompt cannot be trimmed to the {budget}-token budget of {model}")
+        longest = max(candidates, key=lambda i: len(texts[i]))
+        keep = count_tokens(texts[longest], model) - excess - note_tokens
+        trimmed[longest] = {**trimmed[longest], "content": _truncate(texts[longest], keep, model) + _TRUNCATION_NOTE}
+
+
+class TokenUsage:
+    """Thread-safe per-model record of prompt/completion tokens, latency, cache hits and shared calls"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models = {}
+
+    def record(self, model, prompt_tokens, completion_tokens, latency, cached=False, trimmed=False, shared=False):
+        with self._lock:
+            stats = self._models.setdefault(model, {
+                'calls': 0,
+                'cached_calls': 0,
+                'shared_calls': 0,
+                'trimmed_prompts': 0,
+                'prompt_tokens': 0,
+                'completion_tokens': 0,
+                'total_latency': 0.0,
+            })
+            stats['calls'] += 1
+            stats['total_latency'] += latency
+            if cached:
+                # Served from cache: nothing was sent to the API
+                stats['cached_calls'] += 1
+                return
+            if shared:
+                # Answered by an identical request already in flight
+                stats['shared_calls'] += 1
+                return
+            stats['trimmed_prompts'] += int(trimmed)
+            stats['prompt_tokens'] += prompt_tokens
+            stats['completion_tokens'] += completion_tokens
+
+    def summary(self):
+        """Per-model totals with average latency, for the metrics panel"""
+        with self._lock:
+            return {
+                model: {
+                    **{name: value for name, value in stats.items() if name != 'total_latency'},
+                    'avg_latency_s': round(stats['total_latency'] / stats['calls'], 3) if stats['calls'] else 0.0,
+                }
+                for model, stats in self._models.items()
+            }
+
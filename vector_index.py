@@ -0,0 +1,83 @@
+import os
+import threading
+
+import numpy as np
+
+from document_store import document_path, private_dir, text_digest
+
+EMBEDDING_MODEL = os.getenv('LEXIGUIDE_EMBEDDING_MODEL', 'text-embedding-3-small')
+# Passages embedded per API request
+EMBEDDING_BATCH_SIZE = int(os.getenv('LEXIGUIDE_EMBEDDING_BATCH_SIZE', '64'))
+
+
+def embed_in_batches(texts, embed, batch_size=None):
+    """Embed texts with one embed() call per batch, returning a float32 matrix
+
+    embed is called with a list of strings and returns one vector per string.
+    """
+    batch_size = batch_size or EMBEDDING_BATCH_SIZE
+    rows = []
+    for start in range(0, len(texts), batch_size):
+        rows.extend(embed(texts[start:start + batch_size]))
+    return np.asarray(rows, dtype=np.float32)
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+class VectorIndex:
+    """Unit-normalized passage embeddings of one document, queried by cosine similarity"""
+
+    def __init__(self, chunks, matrix):
+        self.chunks = chunks
+        self.matrix = matrix
+
+    @classmethod
+    def build(cls, chunks, embed, batch_size=None):
+        if not chunks:
+            return cls(chunks, np.zeros((0, 0), dtype=np.float32))
+        return cls(chunks, _normalize(embed_in_batches(chunks, embed, batch_size)))
+
+    def search(self, query_vector, k):
+        """Return up to k (chunk_index, similarity) pairs, best first"""
+        if not len(self.chunks):
+            return []
+        query = _normalize(np.asarray(query_vector, dtype=np.float32))
+        similarities = self.matrix @ query
+        k = min(k, len(similarities))
+        best = np.argpartition(-similarities, k - 1)[:k]
+        best = best[np.argsort(-similarities[best])]
+        return [(int(i), float(similarities[i])) for i in best]
+
+
+def vector_path(digest, chunks, model=None):
+    """Embeddings file of the given passages, stored next to the document with the given digest
+
+    The name includes a hash of the passages, so a document chunked differently
+    (e.g. page by page while it was extracted) never reuses a mismatched matrix.
+    """
+    chunks_digest = text_digest("\x00".join(chunks))[:16]
+    return document_path(digest, f".{model or EMBEDDING_MODEL}.{chunks_digest}.npy")
+
+
+def load_or_build(digest, chunks, embed, model=None):
+    """Return the vector index of a document's passages, embedding them only if not stored yet
+
+    chunks are the passages of the document's keyword index, so both indexes
+    number the same passages and their rankings can be fused by chunk id.
+    """
+    path = vector_path(digest, chunks, model)
+    if os.path.exists(path):
+        # Memory-mapped: the rows are paged in by the similarity product as needed
+        matrix = np.load(path, mmap_mode='r')
+        if matrix.shape[0] == len(chunks):
+            return VectorIndex(chunks, matrix)
+
+    index = VectorIndex.build(chunks, embed)
+    private_dir(os.path.dirname(path))
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp.npy"
+    np.save(tmp_path, index.matrix)
+    os.replace(tmp_path, path)
+    return index
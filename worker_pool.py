@@ -0,0 +1,38 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+# Processes in the shared pool; callers decide how many tasks to split work into
+POOL_WORKERS = int(os.getenv('LEXIGUIDE_POOL_WORKERS', str(os.cpu_count() or 1)))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return the shared long-lived process pool of POOL_WORKERS processes
+
+    The pool is reused across uploads and sessions so worker processes are not
+    re-spawned each time. It is created once and only replaced after it broke,
+    so a session submitting to it never finds it shut down under it.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Spawn rather than fork: the Streamlit server process is multi-threaded
+            _pool = ProcessPoolExecutor(max_workers=POOL_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def reset_pool(broken):
+    """Drop the shared pool after a worker crashed and broke it
+
+    Only the given broken pool is dropped: if another caller already replaced
+    it, the replacement is left running.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is broken:
+            _pool = None
+    broken.shutdown(wait=False)